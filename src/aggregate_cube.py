@@ -0,0 +1,198 @@
+import itertools
+import json
+import os
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+import derived
+import schema
+
+#-- Aggregate cube ---
+# Build time rollup of mergeable partial aggregates (provider count, sum and count of each measure) for every
+# combination of the low cardinality selectbox dimensions. The KPI cards are answered by picking the cuboid
+# grouped by exactly the active filters, masking a handful of cells and summing the partials, instead of
+# scanning provider rows.
+#
+# One cuboid per subset of filter_dims, always also grouped by base_dims (the dimensions the cards break down
+# by, e.g. gender for the Males: Females card). Distinct NPIs are counted per cell; that count stays mergeable
+# by summing because every dimension is a provider attribute, so an NPI only ever falls in one cell.
+#
+# High cardinality columns (years of experience, medical school, practice size) are left out: crossed with
+# every other dimension they give more cells than there are providers. A filter on one of them is answered
+# from the matching rows instead (a FilterIndex / pushed down select, so only that subset is read), rolled
+# up to base_dims the same way the cube is built.
+
+MIPS_CUBE = {
+    'name': 'mips_cube',
+    'base_dims': ['pri_spec', 'gndr'],
+    'filter_dims': ['st'],
+    'measures': ['final_MIPS_score', 'years_experience', 'num_org_mem'],
+    'npi_col': 'NPI',
+}
+
+OPIOIDS_CUBE = {
+    'name': 'opioids_cube',
+    'base_dims': [],
+    'filter_dims': ['Prscrbr_State_Abrvtn', 'Prscrbr_Type'],
+    'measures': ['years_experience', 'Opioid_Prscrbr_Rate'],
+    'npi_col': 'PRSCRBR_NPI',
+}
+
+LAYOUT_KEYS = ['base_dims', 'filter_dims', 'measures', 'npi_col']
+
+
+def cuboid_name(dims):
+    return '+'.join(dims) if dims else 'all'
+
+
+def partial_aggregates(df: pd.DataFrame, dims, measures, npi_col) -> pd.DataFrame:
+    '''Distinct providers and the sum / count of each measure per combination of dims (one row without dims)'''
+    # measures are summed from their own columns since a measure can also be a dimension (years_experience)
+    values = df[list(dims) + [npi_col]].copy()
+    aggs = {'providers': (npi_col, 'nunique')}
+    for measure in measures:
+        values[f'{measure}_value'] = schema.for_summing(df[measure])
+        aggs[f'{measure}_sum'] = (f'{measure}_value', 'sum')
+        aggs[f'{measure}_count'] = (f'{measure}_value', 'count')
+    if not dims:
+        return pd.DataFrame([{name: values[col].agg(func) for name, (col, func) in aggs.items()}])
+    return values.groupby(list(dims), observed=True, dropna=False).agg(**aggs).reset_index()
+
+
+class AggregateCube:
+    '''Precomputed cuboids of partial aggregates, keyed by the dimensions they are grouped by'''
+
+    def __init__(self, cuboids: dict, base_dims, filter_dims, measures, npi_col):
+        self.cuboids = cuboids
+        self.base_dims = list(base_dims)
+        self.filter_dims = list(filter_dims)
+        self.measures = list(measures)
+        self.npi_col = npi_col
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, base_dims, filter_dims, measures, npi_col):
+        '''Builds one cuboid per subset of filter_dims from provider rows'''
+        cuboids = {}
+        for size in range(len(filter_dims) + 1):
+            for active in itertools.combinations(filter_dims, size):
+                dims = list(base_dims) + list(active)
+                cuboids[cuboid_name(dims)] = partial_aggregates(df, dims, measures, npi_col)
+        return cls(cuboids, base_dims, filter_dims, measures, npi_col)
+
+    def covers(self, filters: dict) -> bool:
+        '''Whether every filtered column is a cube dimension'''
+        return all(col in self.base_dims or col in self.filter_dims for col in filters)
+
+    def row_columns(self):
+        '''Columns needed to roll matching rows up like a cuboid'''
+        return list(dict.fromkeys(self.base_dims + self.measures + [self.npi_col]))
+
+    def cells(self, filters: dict, load_rows=None) -> pd.DataFrame:
+        '''Cells of the cuboid grouped by exactly the filtered dimensions, restricted to the filter values.
+        Filters on columns outside the cube are answered by rolling up load_rows(columns, filters) to base_dims'''
+        if not self.covers(filters):
+            rows = load_rows(self.row_columns(), filters)
+            return partial_aggregates(rows, self.base_dims, self.measures, self.npi_col)
+        active = [dim for dim in self.filter_dims if dim in filters]
+        dims = self.base_dims + active
+        cells = self.cuboids[cuboid_name(dims)]
+        for dim in dims:
+            if dim in filters:
+                cells = cells[cells[dim] == filters[dim]]
+        return cells
+
+    def memory_usage(self):
+        '''Bytes held by the cuboids'''
+        return int(sum(cells.memory_usage(deep=True).sum() for cells in self.cuboids.values()))
+
+    def layout(self) -> dict:
+        return {'base_dims': self.base_dims, 'filter_dims': self.filter_dims, 'measures': self.measures, 'npi_col': self.npi_col}
+
+    def save(self, path):
+        '''Writes each cuboid as a parquet file in a directory, plus the cube layout'''
+        os.makedirs(path, exist_ok=True)
+        for name, cells in self.cuboids.items():
+            cells.to_parquet(os.path.join(path, f'{name}.parquet'), index=False)
+        with open(os.path.join(path, 'cube.json'), 'w') as f:
+            json.dump(self.layout(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'cube.json')) as f:
+            layout = json.load(f)
+        cuboids = {}
+        for size in range(len(layout['filter_dims']) + 1):
+            for active in itertools.combinations(layout['filter_dims'], size):
+                name = cuboid_name(layout['base_dims'] + list(active))
+                cuboids[name] = schema.compact(pd.read_parquet(os.path.join(path, f'{name}.parquet')))
+        return cls(cuboids, **layout)
+
+
+def build_cube(df: pd.DataFrame, spec: dict) -> AggregateCube:
+    '''Builds the cube described by one of the *_CUBE specs'''
+    return AggregateCube.build(df, spec['base_dims'], spec['filter_dims'], spec['measures'], spec['npi_col'])
+
+
+def cube_columns(spec: dict):
+    '''Columns a cube is rolled up from'''
+    return list(dict.fromkeys(spec['base_dims'] + spec['filter_dims'] + spec['measures'] + [spec['npi_col']]))
+
+
+def saved_layout_matches(spec: dict, path) -> bool:
+    '''Whether the cube saved in path was built with the spec's current layout (a changed spec needs a rebuild)'''
+    try:
+        with open(os.path.join(path, 'cube.json')) as f:
+            layout = json.load(f)
+    except FileNotFoundError:
+        return False
+    return all(layout.get(key) == spec[key] for key in LAYOUT_KEYS)
+
+
+def cube_artifact(spec: dict, source_file) -> derived.DerivedArtifact:
+    '''The cube described by one of the *_CUBE specs, rolled up from source_file'''
+    return derived.DerivedArtifact(
+        spec['name'], source_file, cube_columns(spec),
+        build=lambda df: build_cube(df, spec),
+        save=AggregateCube.save,
+        load=AggregateCube.load,
+        describe=lambda cube: f"{sum(len(cells) for cells in cube.cuboids.values())} cells",
+        is_compatible=lambda path: saved_layout_matches(spec, path),
+    )
+
+
+#-- merging partial aggregates ---
+@dataclass
+class ProviderSummary:
+    '''What the KPI cards show for a selection: merged from the cube cells in one pass'''
+    providers: int
+    means: dict                                     # measure -> mean (nan when nothing was reported)
+    by_gender: dict = field(default_factory=dict)   # gender code -> providers (empty when the cube has no gender)
+    specialties: int = None                         # distinct specialties with providers (None without pri_spec)
+
+    def gender_split(self) -> str:
+        '''"M% : F%" of all providers (by code, so an unknown or extra code is never counted as either)'''
+        if not self.providers:
+            return "0.0% : 0.0%"
+        males = self.by_gender.get('M', 0) / self.providers * 100
+        females = self.by_gender.get('F', 0) / self.providers * 100
+        return f"{males:.1f}% : {females:.1f}%"
+
+
+def summarize(cells: pd.DataFrame, measures, gender_dim='gndr', specialty_dim='pri_spec') -> ProviderSummary:
+    '''Provider count, per gender counts, distinct specialties and every measure mean of the selected cells'''
+    partials = ['providers'] + [f'{measure}_sum' for measure in measures] + [f'{measure}_count' for measure in measures]
+    values = cells[partials].to_numpy(dtype='float64', na_value=0)
+    # every partial column is summed at once
+    totals = values.sum(axis=0)
+    by_gender = {}
+    if gender_dim in cells.columns:
+        codes, genders = pd.factorize(cells[gender_dim])
+        counts = np.bincount(codes[codes >= 0], weights=values[codes >= 0, 0], minlength=len(genders))
+        by_gender = {gender: int(count) for gender, count in zip(genders, counts)}
+
+    sums, counts = totals[1:len(measures) + 1], totals[len(measures) + 1:]
+    means = {measure: float(total / count) if count else float('nan') for measure, total, count in zip(measures, sums, counts)}
+    specialties = None
+    if specialty_dim in cells.columns:
+        specialties = cells.loc[values[:, 0] > 0, specialty_dim].nunique()
+    return ProviderSummary(int(totals[0]), means, by_gender, specialties)
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import aggregate_cube as ac
+import build_data
+import dashboard_utils as dbu
+import data_access as dal
+import geo_aggregates as geo
+import query
+import schema
+
+#-- Benchmark harness ---
+# Generates synthetic providers / opioid prescriber tables with the columns and cardinalities of the real
+# cleaned data, at several multiples of the deployed sample size, and times the steps the dashboards run on
+# each rerun (headless, no Streamlit server, no network). The pages themselves are Streamlit scripts, so
+# each step is timed through the functions they call (columns from schema.py, figures from dashboard_utils):
+#   load_data            query backend + first projection of the page columns
+#   filter_data          state x specialty filtered score columns
+#   gender_distribution  KPI cube cells -> ac.summarize (providers, per gender counts, specialties, means)
+#   specialty_map        state x specialty rollup (loaded once, like the page's cache) -> one row per state ->
+#                        the page's choropleth json
+#   make_histogram       binning the five score columns of the filtered rows -> the page's histogram json (built
+#                        by the figure pool, so DASHBOARD_FIGURE_EXECUTOR / DASHBOARD_FIGURE_WORKERS apply)
+# Each step reports min / median wall time over --repeat runs and the peak Python allocation (tracemalloc).
+# tracemalloc does not see Arrow or DuckDB buffers, so every dataset / backend runs in its own interpreter and
+# also reports that process's peak resident size (max_rss_mb, the high-water mark of all its steps).
+#
+# usage: python src/benchmark.py --scales 1,5,25 --backends pandas,duckdb --layouts compact,plain
+#        python src/benchmark.py --scales 1 --output bench_output.txt      (one JSON line per result)
+#        python src/benchmark.py --check-parity      (the backends return the same rows on the real data dir)
+
+# deployed sample sizes (1x); the full CMS data is ~25x
+BASE_PROVIDERS = 40_000
+BASE_PRESCRIBERS = 20_000
+
+# distinct values in the real data (states include DC and the territories)
+STATES = ['CA', 'TX', 'FL', 'NY', 'PA', 'IL', 'OH', 'MI', 'NC', 'GA', 'NJ', 'MA', 'VA', 'WA', 'MN', 'TN', 'IN', 'MO',
+          'MD', 'WI', 'AZ', 'CO', 'SC', 'KY', 'LA', 'AL', 'OR', 'CT', 'OK', 'IA', 'UT', 'KS', 'AR', 'MS', 'NV', 'NE',
+          'NM', 'WV', 'ME', 'NH', 'ID', 'HI', 'RI', 'DE', 'MT', 'SD', 'ND', 'VT', 'AK', 'WY', 'DC', 'PR', 'GU', 'VI',
+          'MP', 'AS']
+NUM_SPECIALTIES = 90
+NUM_MED_SCHOOLS = 400
+NUM_PRESCRIBER_TYPES = 180
+RUCA_CODES = ['1', '1.1', '2', '2.1', '3', '4', '4.1', '5', '6', '7', '7.1', '8', '9', '10', '10.1', '99']
+
+
+#-- synthetic data ---
+def skewed_choice(rng, values, n):
+    '''Zipf-like draw: a few common values (CA, internal medicine) and a long tail, like the CMS columns'''
+    weights = 1 / np.arange(1, len(values) + 1)
+    return np.asarray(values, dtype=object)[rng.choice(len(values), n, p=weights / weights.sum())]
+
+
+def synthetic_providers(n, rng) -> pd.DataFrame:
+    '''One row per NPI with the providers.parquet columns'''
+    years = rng.integers(0, 60, n).astype('float64')
+    years[rng.random(n) < 0.02] = np.nan
+    providers = pd.DataFrame({
+        'NPI': np.arange(1_000_000_000, 1_000_000_000 + n).astype(str),
+        'st': skewed_choice(rng, STATES, n),
+        'pri_spec': skewed_choice(rng, [f'SPECIALTY {i}' for i in range(NUM_SPECIALTIES)], n),
+        # the CMS file pads some genders ('F '), so the backends' whitespace handling is exercised too
+        'gndr': rng.choice(np.array(['M', 'F', 'F '], dtype=object), n, p=[0.5, 0.3, 0.2]),
+        'Med_sch': skewed_choice(rng, ['OTHER'] + [f'SCHOOL {i}' for i in range(NUM_MED_SCHOOLS - 1)], n),
+        'years_experience': years,
+        'num_org_mem': np.round(rng.pareto(1.2, n) * 5 + 1),
+    })
+    for col in schema.MIPS_SCORE_COLUMNS:
+        scores = np.round(np.clip(rng.normal(80, 15, n), 0, 100), 2)
+        scores[rng.random(n) < 0.05] = np.nan
+        providers[col] = scores
+    return providers
+
+
+def synthetic_prescribers(n, rng) -> pd.DataFrame:
+    '''One row per prescriber with the opioids_sample.parquet columns'''
+    years = rng.integers(0, 60, n).astype('float64')
+    years[rng.random(n) < 0.02] = np.nan
+    return pd.DataFrame({
+        'PRSCRBR_NPI': np.arange(2_000_000_000, 2_000_000_000 + n).astype(str),
+        'Prscrbr_Type': skewed_choice(rng, [f'Type {i}' for i in range(NUM_PRESCRIBER_TYPES)], n),
+        'Prscrbr_State_Abrvtn': skewed_choice(rng, STATES, n),
+        'Opioid_Tot_Drug_Cst': np.round(rng.lognormal(6, 1.5, n), 2),
+        'Opioid_Prscrbr_Rate': np.round(np.clip(rng.gamma(2, 3, n), 0, 100), 2),
+        'years_experience': years,
+        'Bene_Avg_Risk_Scre': np.round(rng.lognormal(0.1, 0.4, n), 3),
+        'Bene_Avg_Age': np.round(rng.normal(70, 6, n), 1),
+        'ruca': skewed_choice(rng, RUCA_CODES, n),
+    })
+
+
+def write_dataset(out_dir, scale, layout, seed):
+    '''Writes the synthetic tables (compact dtypes or plain strings / float64 on disk) plus cubes, samples and rollups'''
+    rng = np.random.default_rng(seed)
+    providers = synthetic_providers(int(BASE_PROVIDERS * scale), rng)
+    prescribers = synthetic_prescribers(int(BASE_PRESCRIBERS * scale), rng)
+    if layout == 'compact':
+        providers, prescribers = schema.compact(providers), schema.compact(prescribers)
+    measures = pd.DataFrame({'NPI': providers['NPI'], 'measure_cd': 'Q001'})
+    build_data.write_tables(providers, measures, out_dir)
+    prescribers.to_parquet(os.path.join(out_dir, build_data.OPIOIDS_FILE), index=False)
+    build_data.build_derived(out_dir)
+
+
+#-- timing ---
+def measure(step, repeat):
+    '''Runs step() repeat times: min / median wall ms and peak traced MB'''
+    times, peaks = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        step()
+        times.append((time.perf_counter() - start) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024**2)
+        tracemalloc.stop()
+    return {'min_ms': round(min(times), 2), 'median_ms': round(statistics.median(times), 2), 'peak_mb': round(max(peaks), 2)}
+
+
+def max_rss_mb():
+    '''Peak resident size of this process so far'''
+    # on Linux ru_maxrss also counts the parent's size at fork, VmHWM only this process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except FileNotFoundError:
+        pass
+    # bytes on macOS, KB elsewhere
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024**2 if sys.platform == 'darwin' else 1024), 1)
+
+
+def common_filter(df, cols):
+    '''The most common combination of values, so the filter steps never return nothing'''
+    return df[cols].astype(object).value_counts().index[0]
+
+
+def run_steps(backend_name, repeat):
+    '''Times each dashboard step against the dataset in dal.DATA_DIR'''
+    dal._shared_tables.clear()
+    results = {}
+    tables = {build_data.PROVIDERS_FILE: (schema.MIPS_COLUMNS, schema.MIPS_FILTER_COLUMNS),
+              build_data.OPIOIDS_FILE: (schema.OPIOID_COLUMNS, schema.OPIOID_FILTER_COLUMNS)}
+
+    def load_data():
+        backend = query.make_backend(tables, backend_name)
+        backend.select(build_data.PROVIDERS_FILE, schema.MIPS_SCORE_COLUMNS)
+        return backend
+    results['load_data'] = measure(load_data, repeat)
+
+    backend = load_data()
+    state, specialty = common_filter(backend.select(build_data.PROVIDERS_FILE, ['st', 'pri_spec']), ['st', 'pri_spec'])
+    filters = {'st': state, 'pri_spec': specialty}
+    results['filter_data'] = measure(lambda: backend.select(build_data.PROVIDERS_FILE, schema.MIPS_SCORE_COLUMNS, filters), repeat)
+
+    cube = ac.cube_artifact(ac.MIPS_CUBE, build_data.PROVIDERS_FILE).load_or_build(backend.select)
+    rows = lambda columns, f: backend.select(build_data.PROVIDERS_FILE, columns, f)
+    results['gender_distribution'] = measure(lambda: ac.summarize(cube.cells(filters, rows), cube.measures), repeat)
+
+    # the page loads the rollup once per dataset version (cached); a rerun only picks the states and draws the map
+    rollup = geo.rollup_artifact(geo.GEO_ROLLUP, build_data.OPIOIDS_FILE).load_or_build(backend.select)
+    state_specialty = geo.state_specialty(rollup)
+    results['specialty_map'] = measure(
+        lambda: dbu.make_filterable_by_specialty_cholorpeth(geo.states_for(state_specialty, None), None).to_json(), repeat)
+
+    def make_histogram():
+        histograms = dbu.compute_histograms(backend.select(build_data.PROVIDERS_FILE, schema.MIPS_SCORE_COLUMNS, filters),
+                                            schema.MIPS_SCORE_COLUMNS)
+        for fig in dbu.score_histogram_figures(histograms):
+            fig.to_json()
+    results['make_histogram'] = measure(make_histogram, repeat)
+    return results
+
+
+def run_isolated(data_dir, backend_name, repeat):
+    '''run_steps in a fresh interpreter, so its peak RSS only covers one dataset and backend'''
+    command = [sys.executable, os.path.abspath(__file__), '--run-steps', data_dir, '--backends', backend_name,
+               '--repeat', str(repeat)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+#-- backend parity ---
+def backend_parity(backend_names, values_per_column=20):
+    '''Compares the rows every backend returns for each single column filter on the dataset in dal.DATA_DIR;
+    returns the mismatches as (table, column, value, rows per backend)'''
+    tables = {build_data.PROVIDERS_FILE: (schema.MIPS_COLUMNS, schema.MIPS_FILTER_COLUMNS),
+              build_data.OPIOIDS_FILE: (schema.OPIOID_COLUMNS, schema.OPIOID_FILTER_COLUMNS)}
+    keys = {build_data.PROVIDERS_FILE: 'NPI', build_data.OPIOIDS_FILE: 'PRSCRBR_NPI'}
+    backends = [query.make_backend(tables, name) for name in backend_names]
+    mismatches = []
+    for table, (_, filter_columns) in tables.items():
+        if not os.path.exists(dal.data_path(table)):
+            continue
+        for col in filter_columns:
+            # the options come from the first backend, like a selectbox would
+            values = backends[0].select(table, [col])[col].value_counts().index[:values_per_column]
+            for value in values:
+                rows = [set(backend.select(table, [keys[table]], {col: value})[keys[table]]) for backend in backends]
+                if any(other != rows[0] for other in rows[1:]):
+                    mismatches.append((table, col, value, [len(found) for found in rows]))
+    return mismatches
+
+
+def check_parity(backend_names, label):
+    mismatches = backend_parity(backend_names)
+    for table, col, value, counts in mismatches:
+        print(f"{label}: {table} {col}={value!r} rows differ between backends: {dict(zip(backend_names, counts))}")
+    print(f"{label}: backend parity {'FAILED' if mismatches else 'ok'} ({', '.join(backend_names)})")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard steps on synthetic CMS-shaped data')
+    parser.add_argument('--scales', default='1,5,25', help='comma separated multiples of the deployed sample size')
+    parser.add_argument('--backends', default=','.join(['pandas'] + (['duckdb'] if query.duckdb is not None else [])))
+    parser.add_argument('--layouts', default='compact', help='compact (categoricals / float32) and/or plain on disk')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='append one JSON line per result to this file')
+    parser.add_argument('--check-parity', action='store_true',
+                        help='only check that the backends return the same rows on the real data dir (exit 1 if not)')
+    parser.add_argument('--run-steps', metavar='DATA_DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    backend_names = args.backends.split(',')
+    if args.check_parity:
+        sys.exit(0 if check_parity(backend_names, 'data') else 1)
+    if args.run_steps:
+        # one dataset / backend, run by run_isolated; the results go to stdout as one JSON line
+        dal.DATA_DIR = args.run_steps
+        results = run_steps(backend_names[0], args.repeat)
+        print(json.dumps({'results': results, 'max_rss_mb': max_rss_mb()}))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix='mips_bench_')
+    try:
+        for scale in [float(scale) for scale in args.scales.split(',')]:
+            for layout in args.layouts.split(','):
+                dal.DATA_DIR = os.path.join(work_dir, f'{scale:g}x_{layout}')
+                os.makedirs(dal.DATA_DIR)
+                write_dataset(dal.DATA_DIR, scale, layout, args.seed)
+                if len(backend_names) > 1:
+                    check_parity(backend_names, f'{scale:g}x {layout}')
+                for backend_name in backend_names:
+                    run = run_isolated(dal.DATA_DIR, backend_name, args.repeat)
+                    for step, result in run['results'].items():
+                        row = {'scale': scale, 'layout': layout, 'backend': backend_name, 'step': step, **result,
+                               'max_rss_mb': run['max_rss_mb']}
+                        print(f"{scale:>5g}x {layout:<8} {backend_name:<7} {step:<20} "
+                              f"min {row['min_ms']:>9.1f} ms  median {row['median_ms']:>9.1f} ms  peak {row['peak_mb']:>8.1f} MB")
+                        if args.output:
+                            with open(args.output, 'a') as f:
+                                f.write(json.dumps(row) + '\n')
+                    print(f"{scale:>5g}x {layout:<8} {backend_name:<7} {'process peak rss':<20} {run['max_rss_mb']:>9.1f} MB")
+                shutil.rmtree(dal.DATA_DIR, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
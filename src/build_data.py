@@ -0,0 +1,428 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import aggregate_cube as ac
+import data_access as dal
+import geo_aggregates as geo
+import sampling
+import schema
+
+#-- Streaming CSV -> Parquet build ---
+# Rebuilds the cleaned MIPS tables from the raw CMS downloads without ever holding a whole file in memory:
+#   1. stage:    each raw CSV is streamed in chunks (only the columns we keep, already typed) and every row is
+#                routed to one of N buckets by a hash of its NPI
+#   2. finalize: all rows for an NPI land in the same bucket, so each bucket can be deduped and joined on its
+#                own; peak memory is roughly one bucket, not the national file
+# The output is one parquet part file per bucket (with row group statistics) for each table.
+#
+# Versioned store: part files are named by a hash of their content and only become visible once manifest.json
+# (see data_access.py) lists them. A rebuild from a new or corrected CMS release rewrites just the buckets whose
+# content changed, then swaps the manifest in atomically; the cubes / samples / rollups are only rebuilt for
+# tables whose version changed. `apply` upserts changed provider rows by NPI, touching only the buckets those
+# NPIs hash to.
+# Parts of the previous release are kept (a reader may still be opening them), older ones are deleted.
+#
+# usage: python src/build_data.py build --raw-dir data/raw --out-dir data/cleaned
+#        python src/build_data.py split            (re-split an existing df_master.parquet)
+#        python src/build_data.py apply --table providers.parquet --rows changed.csv [--deleted npis.csv]
+#        python src/build_data.py cube             (rebuild the KPI aggregate cubes only)
+#        python src/build_data.py sample           (redraw the stratified histogram samples only)
+#        python src/build_data.py rollup           (rebuild the geography rollups only)
+
+# columns that come from ec_public_reporting (one row per provider x measure)
+MEASURE_COLUMNS = ['measure_cd', 'measure_title', 'invs_msr', 'attestation_value', 'prf_rate',
+                   'patient_count', 'star_value', 'five_star_benchmark']
+# overall MIPS scores (ec_score_file)
+SCORE_COLUMNS = ['Org_PAC_ID', 'final_MIPS_score_without_CPB', 'final_MIPS_score', 'Quality_category_score',
+                 'PI_category_score', 'IA_category_score', 'Cost_category_score']
+# provider characteristics (DAC_NationalDownloadableFile), minus the columns the notebook dropped
+DOCS_COLUMNS = ['lst_nm', 'frst_nm', 'gndr', 'Cred', 'Med_sch', 'Grd_yr', 'pri_spec', 'sec_spec_1', 'Telehlth',
+                'org_pac_id', 'num_org_mem', 'st', 'zip']
+
+# raw file name, projected columns, encoding
+RAW_FILES = {
+    'scores': ('ec_score_file.csv', ['NPI'] + SCORE_COLUMNS, None),
+    'measures': ('ec_public_reporting.csv', ['NPI'] + MEASURE_COLUMNS, None),
+    'docs': ('DAC_NationalDownloadableFile.csv', ['NPI'] + DOCS_COLUMNS, 'latin1'),
+}
+
+# explicit dtypes for the non-string columns (everything else stays a string)
+FLOAT_COLUMNS = ['final_MIPS_score_without_CPB', 'final_MIPS_score', 'Quality_category_score',
+                 'PI_category_score', 'IA_category_score', 'Cost_category_score', 'prf_rate']
+INT_COLUMNS = ['patient_count', 'star_value', 'five_star_benchmark', 'Grd_yr', 'num_org_mem']
+
+# reference year used for years of experience (MIPS 2023 performance year)
+PERFORMANCE_YEAR = 2023
+
+PROVIDERS_FILE = 'providers.parquet'
+MEASURES_FILE = 'measures.parquet'
+OPIOIDS_FILE = 'opioids_sample.parquet'
+
+# derived artifacts (derived.py), each built from one of the tables: the KPI aggregate cubes, the stratified
+# histogram samples and the geography rollups
+CUBES = [ac.cube_artifact(ac.MIPS_CUBE, PROVIDERS_FILE), ac.cube_artifact(ac.OPIOIDS_CUBE, OPIOIDS_FILE)]
+SAMPLES = [sampling.sample_artifact(sampling.MIPS_SAMPLE, PROVIDERS_FILE)]
+ROLLUPS = [geo.rollup_artifact(geo.GEO_ROLLUP, OPIOIDS_FILE)]
+DERIVED = CUBES + SAMPLES + ROLLUPS
+
+# tables stored as one parquet file (not built here), registered in the manifest by a hash of the file
+SINGLE_FILE_TABLES = [OPIOIDS_FILE]
+
+
+def arrow_schema(columns):
+    '''Arrow schema for a projected raw file, so every staged chunk has identical types'''
+    fields = []
+    for col in columns:
+        if col in FLOAT_COLUMNS:
+            fields.append(pa.field(col, pa.float64()))
+        elif col in INT_COLUMNS:
+            fields.append(pa.field(col, pa.int64()))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+def cast_chunk(chunk: pd.DataFrame, columns) -> pd.DataFrame:
+    '''Projects a raw chunk to the wanted columns, strips whitespace and applies the explicit dtypes'''
+    # missing columns come back as all null, so every chunk has the same shape
+    chunk = schema.strip_strings(chunk.reindex(columns=columns))
+    for col in columns:
+        if col in FLOAT_COLUMNS:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('Float64')
+        elif col in INT_COLUMNS:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('Int64')
+    return chunk
+
+
+def npi_buckets(npi: pd.Series, buckets: int):
+    '''Stable bucket number for each NPI (same NPI -> same bucket on every run)'''
+    return pd.util.hash_pandas_object(npi, index=False).to_numpy() % buckets
+
+
+def stage_raw_file(path, columns, encoding, staging_dir, buckets, chunksize):
+    '''Streams one raw CSV into per bucket staging parquet files'''
+    schema = arrow_schema(columns)
+    writers = {}
+    wanted = set(columns)
+    try:
+        # raw headers have stray spaces, so project on the stripped name
+        reader = pd.read_csv(path, dtype=str, encoding=encoding, chunksize=chunksize,
+                             usecols=lambda col: col.strip() in wanted)
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip()
+            chunk = cast_chunk(chunk.dropna(subset=['NPI']), columns)
+            for bucket, part in chunk.groupby(npi_buckets(chunk['NPI'], buckets)):
+                if bucket not in writers:
+                    writers[bucket] = pq.ParquetWriter(os.path.join(staging_dir, f'{bucket:05d}.parquet'), schema)
+                writers[bucket].write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
+def read_staged(staging_dir, name, bucket, columns):
+    '''Reads one staged bucket (empty frame if no rows hashed there)'''
+    path = os.path.join(staging_dir, name, f'{bucket:05d}.parquet')
+    if not os.path.exists(path):
+        return arrow_schema(columns).empty_table().to_pandas()
+    return pd.read_parquet(path)
+
+
+def finalize_bucket(scores, measures, docs):
+    '''Dedupes and joins one bucket, returning (providers, measures) like the notebook would'''
+    scores = scores.drop_duplicates()
+    measures = measures.drop_duplicates()
+    # the DAC file can list a provider at several practice locations, keep the first one
+    docs = docs.drop_duplicates(subset=['NPI'])
+
+    providers = scores.merge(docs, how='left', on='NPI')
+    #dropping providers without an org_pac_id, and the duplicate DAC copy of that column
+    providers = providers.dropna(subset=['Org_PAC_ID']).drop(columns=['org_pac_id'])
+    providers = providers.drop_duplicates(subset=['NPI'])
+    providers['years_experience'] = PERFORMANCE_YEAR - providers['Grd_yr']
+
+    measures = measures[measures['NPI'].isin(providers['NPI'])]
+    return providers, measures
+
+
+def content_digest(df: pd.DataFrame) -> str:
+    '''Hash of a frame's columns, dtypes and values (same rows in the same order -> same digest)'''
+    digest = hashlib.sha256(json.dumps([[col, str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def write_part(df: pd.DataFrame, table_dir, bucket, part_schema, row_group_size):
+    '''Writes one bucket of a table as a content-hashed part file with row group statistics; returns its name'''
+    part = f'part-{bucket:05d}-{content_digest(df)}.parquet'
+    path = os.path.join(table_dir, part)
+    if not os.path.exists(path):
+        # the schema is pinned, so a bucket where a column happens to be all null still matches the other parts
+        df.to_parquet(f'{path}.{os.getpid()}.tmp', index=False, schema=part_schema,
+                      row_group_size=row_group_size, write_statistics=True)
+        os.replace(f'{path}.{os.getpid()}.tmp', path)
+    return part
+
+
+def providers_schema():
+    '''Arrow schema of the provider table produced by finalize_bucket'''
+    docs = [field for field in arrow_schema(DOCS_COLUMNS) if field.name != 'org_pac_id']
+    return pa.schema(list(arrow_schema(['NPI'] + SCORE_COLUMNS)) + docs + [pa.field('years_experience', pa.int64())])
+
+
+def swap_directory(new_dir, target):
+    '''Replaces target with new_dir, so readers never see a half written table'''
+    old_dir = target + '.old'
+    if os.path.exists(target):
+        if os.path.isdir(target):
+            os.replace(target, old_dir)
+        else:
+            os.remove(target)
+    os.replace(new_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def table_dir(out_dir, name):
+    '''Directory the parts of a table are written to (replacing a single file table of the same name)'''
+    path = os.path.join(out_dir, name)
+    if os.path.isfile(path):
+        os.remove(path)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+#-- manifest ---
+def table_entry(buckets, parts: dict) -> dict:
+    '''Manifest entry of a partitioned table: its parts by bucket and a version hashed from them'''
+    parts = {str(bucket): part for bucket, part in sorted(parts.items())}
+    version = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+    return {'version': version, 'buckets': buckets, 'parts': parts}
+
+
+def file_entry(path) -> dict:
+    '''Manifest entry of a single file table (the stat lets readers notice the file being replaced by hand)'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    stat = os.stat(path)
+    return {'version': digest.hexdigest()[:16], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def publish(out_dir, tables=None, derived=None) -> dict:
+    '''Writes a new manifest (atomically) with updated table and derived artifact entries'''
+    previous = dal.read_manifest(out_dir)
+    manifest = {
+        'release': previous.get('release', 0) + 1,
+        'published': time.time(),
+        'tables': {**previous.get('tables', {}), **(tables or {})},
+        'derived': {**previous.get('derived', {}), **(derived or {})},
+    }
+    for name in SINGLE_FILE_TABLES:
+        path = os.path.join(out_dir, name)
+        if os.path.isfile(path) and dal.manifest_entry(name, out_dir) is None:
+            manifest['tables'][name] = file_entry(path)
+
+    path = os.path.join(out_dir, dal.MANIFEST_FILE)
+    with open(f'{path}.{os.getpid()}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f'{path}.{os.getpid()}.tmp', path)
+    if tables:
+        remove_unlisted_parts(out_dir, manifest, previous)
+    return manifest
+
+
+def remove_unlisted_parts(out_dir, manifest, previous):
+    '''Deletes part files that neither the new nor the previous release lists'''
+    for name, entry in manifest['tables'].items():
+        if 'parts' not in entry:
+            continue
+        keep = set(entry['parts'].values()) | set(previous.get('tables', {}).get(name, {}).get('parts', {}).values())
+        for file in os.scandir(os.path.join(out_dir, name)):
+            if file.name.endswith('.parquet') and file.name not in keep:
+                os.remove(file.path)
+
+
+def write_tables(providers: pd.DataFrame, measures: pd.DataFrame, out_dir=dal.DATA_DIR, buckets=16, row_group_size=100_000):
+    '''Writes in-memory provider and measure tables in the same partitioned layout as the streaming build'''
+    tables = {}
+    for name, df in ((PROVIDERS_FILE, providers), (MEASURES_FILE, measures)):
+        # stripped here too, like cast_chunk does for the streaming build ('F ' in the notebook's df_master)
+        df = schema.strip_strings(df.copy())
+        part_schema = pa.Schema.from_pandas(df, preserve_index=False)
+        path = table_dir(out_dir, name)
+        parts = {bucket: write_part(part, path, bucket, part_schema, row_group_size)
+                 for bucket, part in df.groupby(npi_buckets(df['NPI'], buckets))}
+        tables[name] = table_entry(buckets, parts)
+    publish(out_dir, tables)
+
+
+def build(raw_dir, out_dir, buckets, chunksize, row_group_size):
+    '''Streams the raw CMS files into the partitioned providers / measures tables'''
+    os.makedirs(out_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(dir=out_dir)
+    try:
+        for name, (filename, columns, encoding) in RAW_FILES.items():
+            print(f"staging {filename}")
+            os.makedirs(os.path.join(staging_dir, name))
+            stage_raw_file(os.path.join(raw_dir, filename), columns, encoding,
+                           os.path.join(staging_dir, name), buckets, chunksize)
+
+        providers_dir, measures_dir = table_dir(out_dir, PROVIDERS_FILE), table_dir(out_dir, MEASURES_FILE)
+        provider_parts, measure_parts = {}, {}
+        provider_count = 0
+        for bucket in range(buckets):
+            providers, measures = finalize_bucket(
+                read_staged(staging_dir, 'scores', bucket, RAW_FILES['scores'][1]),
+                read_staged(staging_dir, 'measures', bucket, RAW_FILES['measures'][1]),
+                read_staged(staging_dir, 'docs', bucket, RAW_FILES['docs'][1]),
+            )
+            # unchanged buckets hash to the part file that is already there, so only changed ones are written
+            provider_parts[bucket] = write_part(providers, providers_dir, bucket, providers_schema(), row_group_size)
+            measure_parts[bucket] = write_part(measures, measures_dir, bucket, arrow_schema(RAW_FILES['measures'][1]), row_group_size)
+            provider_count += len(providers)
+
+        previous = dal.read_manifest(out_dir).get('tables', {}).get(PROVIDERS_FILE, {}).get('parts', {})
+        changed = sum(previous.get(str(bucket)) != part for bucket, part in provider_parts.items())
+        publish(out_dir, {PROVIDERS_FILE: table_entry(buckets, provider_parts),
+                          MEASURES_FILE: table_entry(buckets, measure_parts)})
+        print(f"wrote {provider_count} providers in {buckets} partitions to {out_dir} ({changed} changed)")
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    build_derived(out_dir)
+
+
+def build_derived(out_dir, artifacts=None, force=False):
+    '''Rebuilds the derived artifacts (all of DERIVED by default) whose source table changed, or all with force'''
+    for artifact in artifacts or DERIVED:
+        if not os.path.exists(os.path.join(out_dir, artifact.source_file)):
+            print(f"skipping {artifact.name}: {artifact.source_file} not found")
+            continue
+        if not force and artifact.is_current(out_dir):
+            print(f"{artifact.name} is up to date")
+            continue
+        version = dal.dataset_version(artifact.source_file, out_dir)
+        built = artifact.build(schema.compact(dal.read_parquet(artifact.source_file, artifact.columns, out_dir)))
+        # saved next to the target and swapped in, so a reader never sees a half written artifact
+        target = artifact.path(out_dir)
+        tmp_target = f'{target}.{os.getpid()}.tmp'
+        artifact.save(built, tmp_target)
+        if os.path.isdir(tmp_target):
+            swap_directory(tmp_target, target)
+        else:
+            os.replace(tmp_target, target)
+        publish(out_dir, derived={artifact.name: version})
+        print(f"wrote {artifact.name} ({artifact.describe(built)})")
+
+
+def read_delta_rows(path, part_schema) -> pd.DataFrame:
+    '''Reads a file of changed rows (csv or parquet) with the column types of the table they go into'''
+    if path.endswith('.parquet'):
+        table = pq.read_table(path, columns=part_schema.names)
+    else:
+        table = pacsv.read_csv(path, convert_options=pacsv.ConvertOptions(
+            column_types=part_schema, include_columns=part_schema.names, include_missing_columns=True))
+    return schema.strip_strings(table.cast(part_schema).to_pandas())
+
+
+def apply_delta(out_dir, name, rows: pd.DataFrame, deleted=(), row_group_size=100_000):
+    '''Upserts rows (by NPI) into a published partitioned table and deletes NPIs, rewriting only their buckets'''
+    entry = dal.manifest_entry(name, out_dir)
+    if entry is None or 'parts' not in entry:
+        raise ValueError(f"{name} is not a published partitioned table in {out_dir} (run build or split first)")
+    path = os.path.join(out_dir, name)
+    parts = {int(bucket): part for bucket, part in entry['parts'].items()}
+    part_schema = pq.read_schema(os.path.join(path, next(iter(parts.values()))))
+    rows = rows.astype({'NPI': str})
+    changed_npis = pd.concat([rows['NPI'], pd.Series(list(deleted), dtype=str)], ignore_index=True)
+    row_buckets = npi_buckets(rows['NPI'], entry['buckets'])
+
+    for bucket in sorted(set(npi_buckets(changed_npis, entry['buckets']))):
+        current = pd.read_parquet(os.path.join(path, parts[bucket])) if bucket in parts else part_schema.empty_table().to_pandas()
+        updated = pd.concat([current[~current['NPI'].isin(changed_npis)], rows[row_buckets == bucket]], ignore_index=True)
+        if updated.empty:
+            parts.pop(bucket, None)
+        else:
+            parts[bucket] = write_part(updated, path, bucket, part_schema, row_group_size)
+    publish(out_dir, {name: table_entry(entry['buckets'], parts)})
+    print(f"applied {len(rows)} upserts and {len(deleted)} deletes to {name}")
+
+
+def split_master(df_master: pd.DataFrame) -> tuple:
+    '''Splits the exploded provider x measure table into (providers, measures)'''
+    # stripped before the dedupes, so 'F ' and 'F' rows of one provider compare equal
+    df_master = schema.strip_strings(df_master.copy())
+    measure_columns = [col for col in MEASURE_COLUMNS if col in df_master.columns]
+    measures = df_master[['NPI'] + measure_columns].dropna(subset=measure_columns, how='all').drop_duplicates()
+    # the DAC file can list a provider at several practice locations, keep the first one
+    providers = df_master.drop(columns=measure_columns).drop_duplicates(subset=['NPI'])
+    return providers.reset_index(drop=True), measures.reset_index(drop=True)
+
+
+def split(out_dir):
+    '''Re-splits an existing df_master.parquet (built by the notebook) into the partitioned tables'''
+    df_master = pd.read_parquet(os.path.join(out_dir, 'df_master.parquet'))
+    providers, measures = split_master(df_master)
+    write_tables(providers, measures, out_dir)
+    print(f"wrote {len(providers)} providers and {len(measures)} measures (fan-out {len(df_master) / max(len(providers), 1):.1f}x)")
+    build_derived(out_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the cleaned MIPS dashboard tables')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subcommands.add_parser('build', help='stream the raw CMS csv files into partitioned parquet')
+    build_parser.add_argument('--raw-dir', default=os.path.join(dal.DATA_DIR, '..', 'raw'))
+    build_parser.add_argument('--out-dir', default=dal.DATA_DIR)
+    build_parser.add_argument('--buckets', type=int, default=64, help='NPI hash partitions (more = less memory)')
+    build_parser.add_argument('--chunksize', type=int, default=200_000, help='csv rows read at a time')
+    build_parser.add_argument('--row-group-size', type=int, default=100_000)
+
+    split_parser = subcommands.add_parser('split', help='split an existing df_master.parquet')
+    split_parser.add_argument('--out-dir', default=dal.DATA_DIR)
+
+    apply_parser = subcommands.add_parser('apply', help='upsert changed rows (by NPI) into a published table')
+    apply_parser.add_argument('--out-dir', default=dal.DATA_DIR)
+    apply_parser.add_argument('--table', default=PROVIDERS_FILE)
+    apply_parser.add_argument('--rows', help='csv or parquet file of new / corrected rows (the table columns)')
+    apply_parser.add_argument('--deleted', help='csv file with an NPI column of providers to remove')
+
+    cube_parser = subcommands.add_parser('cube', help='rebuild the KPI aggregate cubes from the cleaned tables')
+    cube_parser.add_argument('--out-dir', default=dal.DATA_DIR)
+
+    sample_parser = subcommands.add_parser('sample', help='redraw the stratified samples from the cleaned tables')
+    sample_parser.add_argument('--out-dir', default=dal.DATA_DIR)
+
+    rollup_parser = subcommands.add_parser('rollup', help='rebuild the geography rollups from the cleaned tables')
+    rollup_parser.add_argument('--out-dir', default=dal.DATA_DIR)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.raw_dir, args.out_dir, args.buckets, args.chunksize, args.row_group_size)
+    elif args.command == 'split':
+        split(args.out_dir)
+    elif args.command == 'apply':
+        part_schema = pq.read_schema(dal.table_files(args.table, args.out_dir)[0])
+        rows = read_delta_rows(args.rows, part_schema) if args.rows else part_schema.empty_table().to_pandas()
+        deleted = pd.read_csv(args.deleted, dtype=str)['NPI'].tolist() if args.deleted else []
+        apply_delta(args.out_dir, args.table, rows, deleted)
+        build_derived(args.out_dir)
+    elif args.command == 'sample':
+        build_derived(args.out_dir, SAMPLES, force=True)
+    elif args.command == 'rollup':
+        build_derived(args.out_dir, ROLLUPS, force=True)
+    else:
+        build_derived(args.out_dir, CUBES, force=True)
+
+
+if __name__ == '__main__':
+    main()
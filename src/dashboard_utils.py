@@ -1,6 +1,165 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+import psutil
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import figure_pool
+import query
+import warmup
+
+# plotly is imported inside the figure functions, so a page's first run gets its KPI cards out before paying for
+# it (the warm-up thread below usually has it imported by then)
+
+#-- Query backend ---
+@st.cache_resource(max_entries=2)
+def load_query_backend(table, columns, index_columns, dataset_version):
+    '''One query backend per process and dataset version for a dashboard's table (duckdb over parquet, or in-memory pandas)'''
+    return query.make_backend({table: (list(columns), list(index_columns))})
+
+@st.cache_data
+def selectbox_options(_backend, table, col, dataset_version):
+    '''Sorted distinct values of a column, computed once per dataset version'''
+    return _backend.distinct(table, col)
+
+#-- Warm-up ---
+# The first run of a page (per process and dataset version) starts a background thread that imports plotly, starts
+# the figure pool (figure_pool.py) and runs the page's warm-up steps, usually the cached builders of its below-the-fold figures, so that the first
+# user doesn't pay for them when opening a section. `warmup.py --server URL` makes that first run a headless session
+# opened at boot, so not even the first visitor does; see warmup.py for the boot time side and the status files.
+@st.cache_resource(max_entries=1)
+def start_warmup(page, dataset_version, _steps=()):
+    '''Starts the page's warm-up once per process and dataset version; steps are (label, callable) pairs'''
+    thread = warmup.background_thread(page, [('imports', warmup.import_heavy_modules), ('figure pool', figure_pool.start)] + list(_steps))
+    # the cached builders look for a script run context, so the thread borrows the one of the run that started it
+    add_script_run_ctx(thread, get_script_run_ctx())
+    thread.start()
+    return thread
+
+#-- Profiling ---
+# profile(section, kind) wraps a step of a page (load / filter / aggregate / figure / chart) and records its wall
+# time, the bytes it allocated (tracemalloc) and, for charts, the plotly payload sent to the browser.
+# Off unless DASHBOARD_TRACE_FILE is set (one JSON line per section per rerun, appended to that file) or the
+# debug sidebar is on (DASHBOARD_DEBUG=1, set by whoever runs the server, not by a visitor). Sections are not
+# meant to be nested, and tracemalloc counts every thread, so concurrent sessions can inflate each other's byte
+# counts. tracemalloc only runs while some session is in a traced rerun (start_trace .. show_trace, or a fragment
+# rerun of a dbu.fragment), since it slows every allocation in the process down.
+TRACE_FILE = os.environ.get('DASHBOARD_TRACE_FILE')
+_trace_file_lock = threading.Lock()
+# sessions in a traced rerun
+_tracing_sessions = set()
+_tracing_lock = threading.Lock()
+
+
+def debug_enabled():
+    return os.environ.get('DASHBOARD_DEBUG') == '1'
+
+
+def tracing():
+    return bool(TRACE_FILE) or debug_enabled()
+
+
+def start_trace(page):
+    '''Starts this rerun's trace (called once at the top of a page)'''
+    st.session_state['trace'] = {'page': page, 'run': uuid.uuid4().hex[:12], 'sections': []}
+    if not tracing():
+        return
+    # a rerun interrupted before show_trace leaves its session in the set; this rerun takes the entry over
+    with _tracing_lock:
+        _tracing_sessions.add(get_script_run_ctx().session_id)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def end_trace():
+    '''Ends this session's traced rerun; tracemalloc stops once no session is tracing'''
+    with _tracing_lock:
+        _tracing_sessions.discard(get_script_run_ctx().session_id)
+        if not _tracing_sessions and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def record_section(record):
+    trace = st.session_state.setdefault('trace', {'page': None, 'run': None, 'sections': []})
+    trace['sections'].append(record)
+    if TRACE_FILE:
+        line = {'ts': time.time(), 'page': trace['page'], 'run': trace['run'],
+                'rss_mb': round(psutil.Process(os.getpid()).memory_info().rss / 1024**2, 1), **record}
+        with _trace_file_lock, open(TRACE_FILE, 'a') as f:
+            f.write(json.dumps(line, default=str) + '\n')
+
+
+@contextmanager
+def profile(section, kind):
+    '''Times a page step; yields a dict the caller can add fields to (e.g. rows)'''
+    if not tracing():
+        yield {}
+        return
+    record = {'section': section, 'kind': kind}
+    tracemalloc.reset_peak()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        record['wall_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        record['alloc_bytes'] = current_bytes - start_bytes
+        record['peak_bytes'] = peak_bytes - start_bytes
+        record_section(record)
+
+
+def plotly_chart(fig, section, **kwargs):
+    '''st.plotly_chart, profiled: serialization time and the size of the figure json sent to the browser'''
+    payload_bytes = len(fig.to_json()) if tracing() else None
+    with profile(section, 'chart') as record:
+        record['payload_bytes'] = payload_bytes
+        st.plotly_chart(fig, **kwargs)
+
+
+def fragment(func):
+    '''st.fragment whose own reruns are traced as runs of their own (they skip the page's start_trace / show_trace)'''
+    @functools.wraps(func)
+    def body(*args, **kwargs):
+        if not get_script_run_ctx().fragment_ids_this_run:
+            # part of a full rerun, already traced by the page
+            return func(*args, **kwargs)
+        start_trace(st.session_state.get('trace', {}).get('page'))
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if tracing():
+                end_trace()
+    return st.fragment(body)
+
+
+def show_trace():
+    '''Ends the rerun's trace and shows its sections in the debug sidebar (called once at the bottom of a page)'''
+    if tracing():
+        end_trace()
+    if not debug_enabled():
+        return
+    trace = st.session_state.get('trace', {'sections': []})
+    with st.sidebar:
+        st.subheader("Profiling")
+        st.caption(f"run {trace.get('run')}")
+        st.caption(f"warm-up: {warmup.read_status(trace.get('page'))['state']}, data: {warmup.read_status('data')['state']}")
+        if trace['sections']:
+            sections = pd.DataFrame(trace['sections'])
+            st.metric("Rerun wall time", f"{sections['wall_ms'].sum():.0f} ms")
+            st.dataframe(sections, hide_index=True)
+
+#-- Lazy sections ---
+def lazy_section(label, key, expanded=False):
+    '''Expander that tracks whether it is open (toggling it reruns), so callers only build its body while .open'''
+    return st.expander(label, expanded=expanded, key=key, on_change='rerun')
 
 #-- KPI like Metrics ---
 def metric_card(label, value, color="#23272b", text_color="#fff", icon=None):
@@ -25,16 +184,196 @@ def metric_card(label, value, color="#23272b", text_color="#fff", icon=None):
     """
     st.markdown(html, unsafe_allow_html=True)
 
+#-- Histograms ---
+# Bins and box plot statistics are computed here, so plotly only receives ~110 bar heights and 5 box
+# values per chart instead of every row (which is what forced the old 2000 row samples).
+HISTOGRAM_BINS = 110
+
+
+def weighted_quartiles(values, valid, weights):
+    '''25th / 50th / 75th percentiles of each column, each row counted weight times'''
+    quartiles = np.zeros((3, values.shape[1]))
+    for i in range(values.shape[1]):
+        col_values, col_weights = values[valid[:, i], i], weights[valid[:, i]]
+        if not len(col_values):
+            continue
+        order = np.argsort(col_values, kind='stable')
+        # midpoint of each row's share of the cumulative weight, interpolated like np.percentile
+        cumulative = np.cumsum(col_weights[order]) - col_weights[order] / 2
+        quartiles[:, i] = np.interp(np.array([0.25, 0.5, 0.75]) * col_weights.sum(), cumulative, col_values[order])
+    return quartiles
+
+
+def compute_histograms(df, columns, nbins=HISTOGRAM_BINS, weights=None):
+    '''Bin counts and box plot statistics for several numeric columns in one vectorized pass
+
+    weights (one per row, e.g. the sample_weight of a stratified sample) turn the counts into estimates for the
+    population the rows were drawn from'''
+    values = df[columns].to_numpy(dtype='float64', na_value=np.nan)
+    valid = ~np.isnan(values)
+    has_values = valid.any(axis=0)
+    # per column range (0..1 for columns with nothing to plot, so the arithmetic below stays finite)
+    lo = np.where(has_values, np.min(np.where(valid, values, np.inf), axis=0, initial=np.inf), 0)
+    hi = np.where(has_values, np.max(np.where(valid, values, -np.inf), axis=0, initial=-np.inf), 1)
+    width = np.where(hi > lo, (hi - lo) / nbins, 1 / nbins)
+
+    # offset each column's bin numbers so a single bincount covers every column
+    bins = np.clip(np.floor((values - lo) / width), 0, nbins - 1)
+    offsets = np.arange(len(columns)) * nbins
+    flat_bins = (np.where(valid, bins, 0) + offsets)[valid].astype(np.int64)
+    if weights is None:
+        counts = np.bincount(flat_bins, minlength=len(columns) * nbins)
+        totals = valid.sum(axis=0)
+    else:
+        weights = np.asarray(weights, dtype='float64')
+        flat_weights = np.broadcast_to(weights[:, None], values.shape)[valid]
+        counts = np.bincount(flat_bins, weights=flat_weights, minlength=len(columns) * nbins)
+        totals = np.where(valid, weights[:, None], 0).sum(axis=0)
+    counts = counts.reshape(len(columns), nbins)
+
+    if not values.shape[0]:
+        q1 = median = q3 = np.zeros(len(columns))
+    elif weights is None:
+        q1, median, q3 = np.nanpercentile(np.where(has_values, values, 0), [25, 50, 75], axis=0)
+    else:
+        q1, median, q3 = weighted_quartiles(values, valid, weights)
+    # whiskers end at the most extreme points within 1.5 IQR, like plotly's box
+    iqr = q3 - q1
+    lowerfence = np.min(np.where(valid & (values >= q1 - 1.5 * iqr), values, np.inf), axis=0, initial=np.inf)
+    upperfence = np.max(np.where(valid & (values <= q3 + 1.5 * iqr), values, -np.inf), axis=0, initial=-np.inf)
+
+    histograms = {}
+    for i, col in enumerate(columns):
+        histograms[col] = {
+            'edges': lo[i] + width[i] * np.arange(nbins + 1),
+            'counts': counts[i],
+            'count': totals[i].item(),
+            'q1': q1[i], 'median': median[i], 'q3': q3[i],
+            'lowerfence': lowerfence[i], 'upperfence': upperfence[i],
+        }
+    return histograms
+
+
+def make_binned_histogram(histogram, x_col, title, bar_color):
+    '''Draws a histogram (with a box plot above it) from compute_histograms output'''
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.25, 0.75], vertical_spacing=0.03)
+    if histogram['count']:
+        fig.add_trace(go.Box(
+            q1=[histogram['q1']], median=[histogram['median']], q3=[histogram['q3']],
+            lowerfence=[histogram['lowerfence']], upperfence=[histogram['upperfence']],
+            name=x_col, orientation='h', marker_color=bar_color, boxpoints=False,
+        ), row=1, col=1)
+    edges = histogram['edges']
+    fig.add_trace(go.Bar(
+        x=(edges[:-1] + edges[1:]) / 2, y=histogram['counts'], width=np.diff(edges),
+        name=x_col, marker_color=bar_color,
+    ), row=2, col=1)
+    fig.update_layout(title=title, height=300, width=500, bargap=0, showlegend=False)
+    fig.update_yaxes(showticklabels=False, row=1, col=1)
+    fig.update_xaxes(title_text=x_col, row=2, col=1)
+    fig.update_yaxes(title_text='count', row=2, col=1)
+    return fig
+
+
 def make_histogram(df, x_col, title, bar_color):
     '''This function creates a histogram of the 'x' variable'''
-    fig = px.histogram(
-        df,
-        x=x_col,
-        nbins=110,
+    return make_binned_histogram(compute_histograms(df, [x_col])[x_col], x_col, title, bar_color)
+
+
+# the MIPS page's score histograms: (score column, title, bar color), in the order they are shown
+SCORE_HISTOGRAMS = [
+    ('final_MIPS_score', "Distribution of Overall Scores", '#25b5b9'),
+    ('Quality_category_score', "Distribution of Quality Scores", '#b9c3eb'),
+    ('IA_category_score', "Distribution of Improvement Activities Scores", '#f83a3e'),
+    ('PI_category_score', "Distribution of Promoting Interoperability Scores", '#39c3eb'),
+    ('Cost_category_score', "Distribution of Cost Scores", '#fde23a'),
+]
+
+
+def score_histogram_figures(histograms):
+    '''The score histogram figures from compute_histograms output, built concurrently by the figure pool, in order'''
+    return figure_pool.build_figures([functools.partial(make_binned_histogram, histograms[col], col, title, color)
+                                      for col, title, color in SCORE_HISTOGRAMS])
+
+
+#-- Maps ---
+#makes the opioids page's main map (can filter by specialties, zoom in one specialty at a time)
+def make_filterable_by_specialty_cholorpeth(opioids_specialties,selected_theme):
+    '''Takes one row per state (from geo.states_for) and draws the prescribing rate map'''
+    import plotly.express as px
+    fig = px.choropleth(
+        opioids_specialties,
+        locations='Prscrbr_State_Abrvtn',
+        locationmode='USA-states',
+        color='prescribing_rate',
+        scope='usa',
+        color_continuous_scale=selected_theme,
+        hover_name='Prscrbr_State_Abrvtn',
+        hover_data={
+            'provider_count': True,
+            'total_opioid_cost' : ':0.1f',
+            'years_exp': ':0.1f',
+        },
+        title='Opioid Prescribing Rate by Specialty',
+        labels={'provider_count': 'Number of Providers', 'prescribing_rate': 'Prescribing Rate','total_opioid_cost': 'Total Opioid Cost','years_exp' : 'Years of Experience'},
+        height=800,
+        width=1200
+    )
+    # Center the title
+    fig.update_layout(
+        title={
+            'text': "Opioid Prescribing Rates by Specialty",
+            'x': 0.5,  # center title
+            'xanchor': 'center',
+            'yanchor': 'top',
+            'font' : {
+                'size' : 36
+            }
+        }
+
+
+)
+    return fig
+
+
+#-- Density scatterplots ---
+# Points are binned into a fixed grid here and drawn as a heatmap, so the payload is nbins x nbins cells
+# whatever the number of rows (a raw px.scatter ships every row to the browser).
+DENSITY_BINS = 60
+
+
+def density_edges(values, nbins):
+    '''Bin edges for one axis; whole-number columns (e.g. years of experience) get one bin per value'''
+    if len(values) and np.all(values == np.round(values)) and values.max() - values.min() < nbins:
+        return np.arange(values.min() - 0.5, values.max() + 1.5)
+    return nbins
+
+
+def make_density_scatter(df, x_col, y_col, title, labels, nbins=DENSITY_BINS, height=600, width=600):
+    '''Draws a 2-D histogram (number of rows per cell) of y_col vs x_col'''
+    import plotly.graph_objects as go
+    points = df[[x_col, y_col]].to_numpy(dtype='float64', na_value=np.nan)
+    points = points[~np.isnan(points).any(axis=1)]
+    bins = [density_edges(points[:, 0], nbins), density_edges(points[:, 1], nbins)]
+    counts, x_edges, y_edges = np.histogram2d(points[:, 0], points[:, 1], bins=bins)
+    # empty cells are left transparent so the chart reads like a scatterplot
+    z = np.where(counts.T > 0, counts.T, np.nan)
+    fig = go.Figure(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=z,
+        colorscale='Blues',
+        colorbar={'title': 'Providers'},
+        hovertemplate=f"{labels.get(x_col, x_col)}: %{{x:.1f}}<br>{labels.get(y_col, y_col)}: %{{y:.1f}}<br>Providers: %{{z}}<extra></extra>",
+    ))
+    fig.update_layout(
         title=title,
-        marginal='box',  # Optional: adds a boxplot above
-        height=300,
-        width=500,
-        color_discrete_sequence=[bar_color]  # Use any hex color or named color
+        xaxis_title=labels.get(x_col, x_col),
+        yaxis_title=labels.get(y_col, y_col),
+        plot_bgcolor='white',
+        height=height,
+        width=width,
     )
-    return fig
\ No newline at end of file
+    return fig
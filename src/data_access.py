@@ -0,0 +1,191 @@
+import glob
+import json
+import os
+try:
+    import fcntl
+except ImportError:  # not on Windows: concurrent conversions there just write their own temp file
+    fcntl = None
+import threading
+import pyarrow as pa
+import pyarrow.dataset as ds
+import schema
+
+#-- Data access layer ---
+# The cleaned parquet files are converted once into uncompressed Arrow IPC files that sit next to them
+# (already in the compact schema.py types). Those files are opened memory-mapped, so the Arrow buffers are
+# backed by the OS page cache instead of the Python heap: resident memory stays roughly flat as the dataset
+# grows, and only the columns a page actually uses are ever touched.
+#
+# Each file is mapped once per process (shared_table) and every session / backend gets the same read-only
+# buffers. Both dashboards map the same files, so the OS shares those pages between the two apps as well.
+# Only the pandas query backend reads through this layer; the default DuckDB backend (query.py) scans the
+# parquet parts directly and never touches the Arrow files.
+#
+# Versions: build_data.py publishes manifest.json, which lists the content-hashed part files of each table
+# and a version per table (a hash of its parts), plus the table version each derived artifact (cubes,
+# samples, rollups) was built from. Readers only ever open the parts the manifest lists, and the manifest is replaced
+# atomically, so a refresh switches every reader to the new version at once; caches keyed by
+# dataset_version() then miss only for the tables that really changed. Data dirs without a manifest (written
+# before it existed) fall back to file modification times.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'cleaned')
+MANIFEST_FILE = 'manifest.json'
+
+
+def data_path(filename):
+    '''Returns the absolute path of a file in data/cleaned (works when deployed)'''
+    return os.path.join(DATA_DIR, filename)
+
+
+#-- manifest ---
+# parsed manifest, reused until the file changes: data dir -> (mtime_ns, manifest)
+_manifests = {}
+
+
+def read_manifest(data_dir=None) -> dict:
+    '''The published manifest of a data dir ({} when there isn't one)'''
+    data_dir = data_dir or DATA_DIR
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached = _manifests.get(data_dir)
+    if cached is None or cached[0] != mtime_ns:
+        with open(path) as f:
+            cached = (mtime_ns, json.load(f))
+        _manifests[data_dir] = cached
+    return cached[1]
+
+
+def manifest_entry(filename, data_dir=None):
+    '''The manifest entry of a table, or None when it isn't listed (or a listed single file was replaced since)'''
+    entry = read_manifest(data_dir).get('tables', {}).get(filename)
+    if entry is None or 'parts' in entry:
+        return entry
+    try:
+        stat = os.stat(os.path.join(data_dir or DATA_DIR, filename))
+    except FileNotFoundError:
+        return None
+    return entry if (stat.st_size, stat.st_mtime_ns) == (entry['size'], entry['mtime_ns']) else None
+
+
+def table_files(filename, data_dir=None):
+    '''Parquet files making up the published version of a table (a single file table is its own part)'''
+    path = os.path.join(data_dir or DATA_DIR, filename)
+    entry = manifest_entry(filename, data_dir)
+    if entry is not None and 'parts' in entry:
+        return [os.path.join(path, part) for _, part in sorted(entry['parts'].items(), key=lambda item: int(item[0]))]
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.parquet')))
+    return [path]
+
+
+def read_parquet(filename, columns=None, data_dir=None):
+    '''Reads the published version of a table straight from its parquet parts (build time, no mirror)'''
+    return ds.dataset(table_files(filename, data_dir), format='parquet').to_table(columns=columns).to_pandas()
+
+
+def source_mtime(parquet_path):
+    '''Last modification time of a parquet file, or of the newest part file in a partitioned directory'''
+    if not os.path.isdir(parquet_path):
+        return os.path.getmtime(parquet_path)
+    return max([os.path.getmtime(parquet_path)] +
+               [os.path.getmtime(entry.path) for entry in os.scandir(parquet_path) if entry.name.endswith('.parquet')])
+
+
+def dataset_version(filename, data_dir=None):
+    '''Short tag that changes whenever a cleaned dataset changes (used to key caches)'''
+    entry = manifest_entry(filename, data_dir)
+    if entry is not None:
+        return entry['version']
+    return f"{source_mtime(os.path.join(data_dir or DATA_DIR, filename)):.0f}"
+
+
+def derived_is_current(name, source_file, data_dir=None):
+    '''Whether a derived artifact (cube, sample, rollup) was built from the current version of its source table'''
+    built_from = read_manifest(data_dir).get('derived', {}).get(name)
+    if built_from is not None:
+        return built_from == dataset_version(source_file, data_dir)
+    # no manifest: compare modification times
+    path = os.path.join(data_dir or DATA_DIR, name)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'cube.json')
+    source = os.path.join(data_dir or DATA_DIR, source_file)
+    return os.path.exists(path) and os.path.exists(source) and os.path.getmtime(path) >= source_mtime(source)
+
+
+#-- memory-mapped mirror ---
+def arrow_path(filename, version):
+    '''Returns the path of the Arrow IPC file that mirrors one version of a table'''
+    return data_path(f'{os.path.splitext(filename)[0]}.{version}.arrow')
+
+
+def ensure_arrow_file(filename):
+    '''Converts the current version of a table to an Arrow IPC file (one batch at a time) if it isn't yet'''
+    target = arrow_path(filename, dataset_version(filename))
+    if os.path.exists(target):
+        return target
+    # one conversion at a time across processes (the boot warm-up and both dashboards may all get here)
+    with open(f'{target}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(target):
+            write_arrow_file(filename, target)
+
+    # mirrors of older versions (already mapped ones stay readable until they are unmapped)
+    base = glob.escape(os.path.splitext(filename)[0])
+    for old in glob.glob(data_path(f'{base}.*arrow')) + glob.glob(data_path(f'{base}.*arrow.lock')):
+        if old not in (target, f'{target}.lock'):
+            os.remove(old)
+    return target
+
+
+def write_arrow_file(filename, target):
+    '''Streams the parquet parts of a table into an Arrow IPC file in the compact types'''
+    dataset = ds.dataset(table_files(filename), format='parquet')
+    target_schema = schema.compact_arrow_schema(dataset.schema)
+    # categories get one dictionary for the whole file (an IPC file can't change dictionaries between batches)
+    dictionaries = {field.name: schema.category_dictionary(dataset.to_table(columns=[field.name]).column(0))
+                    for field in target_schema if pa.types.is_dictionary(field.type)}
+    # write to a temp file and swap it in, so a reader never sees a half written file
+    tmp_target = f'{target}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_target, 'wb') as sink:
+        with pa.ipc.new_file(sink, target_schema) as writer:
+            for batch in dataset.to_batches():
+                writer.write_batch(schema.compact_batch(batch, target_schema, dictionaries))
+    os.replace(tmp_target, target)
+
+
+# process wide registry: filename -> (dataset version, memory-mapped table)
+_shared_tables = {}
+_shared_tables_lock = threading.Lock()
+
+
+def shared_table(filename):
+    '''The process wide, read-only, memory-mapped table for a cleaned dataset (remapped when the file changes)'''
+    version = dataset_version(filename)
+    with _shared_tables_lock:
+        entry = _shared_tables.get(filename)
+        if entry is None or entry[0] != version:
+            source = ensure_arrow_file(filename)
+            entry = (version, pa.ipc.open_file(pa.memory_map(source, 'r')).read_all())
+            _shared_tables[filename] = entry
+    return entry[1]
+
+
+def open_table(filename, columns=None):
+    '''Returns a zero-copy view of the requested columns of the shared memory-mapped table'''
+    table = shared_table(filename)
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def load_dataframe(filename, columns=None):
+    '''Loads only the requested columns of a cleaned dataset into pandas, with compact dtypes'''
+    table = open_table(filename, columns)
+    # the file holds one batch per parquet batch, so each column is concatenated into one array once here;
+    # split_blocks keeps it from being copied again into a consolidated block, and the small ints come out as
+    # the nullable dtypes compact() wants, so it leaves them alone
+    return schema.compact(table.to_pandas(split_blocks=True, types_mapper=schema.PANDAS_INT_TYPES.get))
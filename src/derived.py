@@ -0,0 +1,40 @@
+import os
+import data_access as dal
+
+#-- Derived artifacts ---
+# The KPI cubes (aggregate_cube.py), the stratified samples (sampling.py) and the geography rollups
+# (geo_aggregates.py) are each computed from one cleaned table. build_data.py writes them next to the tables
+# (build_derived) and records in the manifest the version of the table each was built from; a page loads the
+# saved one when it is current and otherwise builds it from the query backend's rows (load_or_build).
+
+
+class DerivedArtifact:
+    '''How one artifact is built from the rows of its source table, saved, loaded and described'''
+
+    def __init__(self, name, source_file, columns, build, save, load, describe, is_compatible=None):
+        # file or directory in the data dir, also its key in the manifest
+        self.name = name
+        self.source_file = source_file
+        # source columns build() needs
+        self.columns = list(columns)
+        self.build = build
+        self.save = save
+        self.load = load
+        self.describe = describe
+        # optional check of a saved artifact's format, so one written by an older layout gets rebuilt
+        self.is_compatible = is_compatible
+
+    def path(self, data_dir=None):
+        return os.path.join(data_dir or dal.DATA_DIR, self.name)
+
+    def is_current(self, data_dir=None) -> bool:
+        '''Whether the saved artifact was built from the current version of its source table, in the current format'''
+        if not dal.derived_is_current(self.name, self.source_file, data_dir):
+            return False
+        return self.is_compatible is None or self.is_compatible(self.path(data_dir))
+
+    def load_or_build(self, select):
+        '''The saved artifact if it is current, else built from select(source_file, columns) (a backend's select)'''
+        if self.is_current():
+            return self.load(self.path())
+        return self.build(select(self.source_file, self.columns))
@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+
+#-- Figure executor ---
+# Independent figures of a rerun (the five MIPS histograms, the three density plots) are built concurrently and
+# handed back in order. A figure is given as a builder callable (usually a functools.partial of a dashboard_utils
+# figure function) so it can be shipped to a worker process:
+#   thread   a thread pool in the Streamlit process (helps only when builders release the GIL, e.g. numpy binning)
+#   process  workers build the figure and return it as a plain dict; it is wrapped back into a go.Figure without
+#            re-validating (plotly figure building is pure python, so only processes get past the GIL). Opt in:
+#            every worker is another python process with plotly loaded. The workers belong to a figure host
+#            process (figure_worker.py); where there is no forkserver the thread pool is used instead
+#   serial   built one after another in the calling thread
+# Pick one with DASHBOARD_FIGURE_EXECUTOR=thread|process|serial (default: thread when there is more than one core)
+# and the pool size with DASHBOARD_FIGURE_WORKERS (default: the number of cores, at most MAX_WORKERS).
+# One pool per Streamlit process, shared by every session.
+
+MAX_WORKERS = 4
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def executor_kind():
+    kind = os.environ.get('DASHBOARD_FIGURE_EXECUTOR')
+    if kind:
+        if kind not in ('process', 'thread', 'serial'):
+            raise ValueError(f"unknown figure executor {kind!r} (expected 'process', 'thread' or 'serial')")
+        return kind
+    return 'thread' if (os.cpu_count() or 1) > 1 else 'serial'
+
+
+def worker_count():
+    workers = os.environ.get('DASHBOARD_FIGURE_WORKERS')
+    return int(workers) if workers else min(os.cpu_count() or 1, MAX_WORKERS)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    '''The process wide figure pool (None for serial), created on first use'''
+    global _executor
+    kind = executor_kind()
+    if kind == 'serial':
+        return None
+    with _executor_lock:
+        if _executor is None:
+            if kind == 'process' and 'forkserver' in multiprocessing.get_all_start_methods():
+                _executor = start_processes()
+            else:
+                _executor = ThreadPoolExecutor(worker_count(), thread_name_prefix='figures')
+        return _executor
+
+
+def start_processes():
+    '''A figure_worker host process with the worker pool (workers are never forked from the server process)'''
+    import figure_worker
+    return figure_worker.start_host(SRC_DIR, worker_count())
+
+
+def start():
+    '''Starts the pool (a warm-up step, so the first rerun doesn't wait for the forkserver and a worker)'''
+    pool = executor()
+    if isinstance(pool, ThreadPoolExecutor):
+        pool.submit(int).result()
+    elif pool is not None:
+        pool.start()
+
+
+def build_figures(builders) -> list:
+    '''Builds independent figures concurrently; returns the go.Figures in the order of the builders'''
+    global _executor
+    pool = executor()
+    if pool is None or len(builders) < 2:
+        return [builder() for builder in builders]
+    if isinstance(pool, ThreadPoolExecutor):
+        return list(pool.map(lambda builder: builder(), builders))
+    import plotly.graph_objects as go
+    try:
+        figures = pool.build_all([pickle.dumps(builder, protocol=pickle.HIGHEST_PROTOCOL) for builder in builders])
+    except (BrokenExecutor, EOFError, OSError):
+        # a worker or the host died (e.g. killed for memory): drop the pool and build these in this process
+        with _executor_lock:
+            if _executor is pool:
+                _executor = None
+                pool.close()
+        return [builder() for builder in builders]
+    # validated in the worker already
+    return [go.Figure(pickle.loads(figure), _validate=False) for figure in figures]
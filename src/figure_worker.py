@@ -0,0 +1,116 @@
+import argparse
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import BaseManager
+
+#-- Figure worker host ---
+# The figure process pool (figure_pool.py) does not run in the Streamlit process: Streamlit installs the running
+# page as __main__, and multiprocessing re-imports the parent's __main__ in every worker it starts, which would
+# re-run the page there. Instead the Streamlit process starts this file as a small host process that owns the
+# pool, so the workers only re-import this module. Its workers are forked from a forkserver and set up by init
+# (the pool initializer), which gets the source dir explicitly and imports plotly once per worker.
+# Builders and figures cross both hops as pickled bytes, so the host itself never loads plotly or the dashboard
+# modules. The host exits when its stdin closes, i.e. with the Streamlit process that started it.
+
+# how long start_host waits for the host to listen
+START_TIMEOUT = 30
+
+
+class FigureHost(BaseManager):
+    '''Connection to (or, in the host, the server of) a figure host process'''
+
+
+FigureHost.register('FigurePool')
+
+
+def init(src_dir):
+    '''Pool initializer: makes the dashboard modules importable and imports plotly once per worker'''
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    import warmup
+    warmup.import_heavy_modules()
+
+
+def build(task: bytes) -> bytes:
+    '''Runs in a worker: builds the figure of a pickled builder and returns the figure's dict, pickled'''
+    builder = pickle.loads(task)
+    return pickle.dumps(builder().to_dict(), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class FigurePool:
+    '''The worker pool, in the host process'''
+
+    def __init__(self, src_dir, workers):
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('forkserver'),
+                                            initializer=init, initargs=(src_dir,))
+
+    def start(self):
+        self.executor.submit(int).result()
+
+    def build_all(self, tasks) -> list:
+        return list(self.executor.map(build, tasks))
+
+
+class HostPool:
+    '''The figure host as seen from the Streamlit process'''
+
+    def __init__(self, process, pool):
+        # keeping the process keeps its stdin open, which keeps the host alive
+        self.process = process
+        self.pool = pool
+
+    def start(self):
+        self.pool.start()
+
+    def build_all(self, tasks) -> list:
+        return self.pool.build_all(tasks)
+
+    def close(self):
+        self.process.kill()
+
+
+def start_host(src_dir, workers) -> HostPool:
+    '''Starts a host process with a pool of workers and connects to it'''
+    # the host's listener removes the socket file when it exits
+    address = os.path.join(tempfile.gettempdir(), f'figure-host-{os.getpid()}-{os.urandom(4).hex()}.sock')
+    authkey = os.urandom(32)
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--src-dir', src_dir,
+                                '--workers', str(workers), '--address', address], stdin=subprocess.PIPE)
+    process.stdin.write(authkey.hex().encode() + b'\n')
+    process.stdin.flush()
+    deadline = time.time() + START_TIMEOUT
+    while not os.path.exists(address):
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            raise RuntimeError(f'figure host did not start (exit code {process.poll()})')
+        time.sleep(0.05)
+    host = FigureHost(address=address, authkey=authkey)
+    host.connect()
+    return HostPool(process, host.FigurePool())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Figure worker host (started by figure_pool)')
+    parser.add_argument('--src-dir', required=True)
+    parser.add_argument('--workers', type=int, required=True)
+    parser.add_argument('--address', required=True)
+    args = parser.parse_args()
+    authkey = bytes.fromhex(sys.stdin.readline().strip())
+    pool = FigurePool(args.src_dir, args.workers)
+    FigureHost.register('FigurePool', callable=lambda: pool)
+    server = FigureHost(address=args.address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, name='figure-host', daemon=True).start()
+    # stdin closes when the process that started the host exits
+    sys.stdin.read()
+    pool.executor.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+#-- Filter index ---
+# Prebuilt value -> rows index for the selectbox columns, so a filter change is a bitmap intersection over
+# a few small arrays instead of one boolean mask (and one frame copy) per selectbox.
+# Frequent values are stored as packed bitmaps (1 bit per row); rare values (e.g. most medical schools)
+# as sorted row ids, whichever is smaller, so the index never costs more than ~4 bytes per row per column.
+
+
+class FilterIndex:
+    '''Per column value -> row bitmap index over a DataFrame'''
+
+    def __init__(self, df: pd.DataFrame, columns):
+        self.num_rows = len(df)
+        self.entries = {}
+        bitmap_bytes = (self.num_rows + 7) // 8
+        for col in columns:
+            codes, uniques = pd.factorize(df[col])
+            # stable sort keeps the row ids of each value in ascending order
+            order = np.argsort(codes, kind='stable')
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            starts = np.searchsorted(codes[order], 0) + np.concatenate([[0], np.cumsum(counts)[:-1]])
+            entries = {}
+            for value, start, count in zip(list(uniques), starts, counts):
+                rows = order[start:start + count].astype(np.int32)
+                if count * rows.itemsize > bitmap_bytes:
+                    mask = np.zeros(self.num_rows, dtype=bool)
+                    mask[rows] = True
+                    entries[value] = np.packbits(mask)
+                else:
+                    entries[value] = rows
+            self.entries[col] = entries
+
+    def values(self, col):
+        '''Distinct (non null) values of an indexed column'''
+        return list(self.entries[col].keys())
+
+    def _is_bitmap(self, entry):
+        return entry.dtype == np.uint8
+
+    def select(self, filters: dict) -> np.ndarray:
+        '''Row positions matching every col == value filter (all rows when there are no filters)'''
+        if not filters:
+            return np.arange(self.num_rows)
+        entries = []
+        for col, value in filters.items():
+            entry = self.entries[col].get(value)
+            if entry is None:
+                return np.array([], dtype=np.int32)
+            entries.append(entry)
+
+        row_lists = [entry for entry in entries if not self._is_bitmap(entry)]
+        bitmaps = [entry for entry in entries if self._is_bitmap(entry)]
+        if row_lists:
+            # start from the shortest row id list and probe the rest
+            row_lists.sort(key=len)
+            rows = row_lists[0]
+            for other in row_lists[1:]:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            for bitmap in bitmaps:
+                # packbits is big-endian within each byte
+                rows = rows[(bitmap[rows >> 3] >> (7 - (rows & 7))) & 1 == 1]
+            return rows
+
+        combined = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            combined = np.bitwise_and(combined, bitmap)
+        return np.flatnonzero(np.unpackbits(combined, count=self.num_rows))
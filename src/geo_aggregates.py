@@ -0,0 +1,97 @@
+import pandas as pd
+import derived
+import schema
+
+#-- Geography rollups ---
+# Build time table of mergeable partials (distinct prescribers, sums and counts) by ruca x state x specialty,
+# computed in one grouped pass over the prescriber rows (build_data.py) and stored as one small parquet file.
+# Every view of the page is a sum over some of its rows: the state x specialty table behind the maps, and the
+# RUCA chart for whatever the sidebar has selected, so no rerun groups prescriber rows.
+#
+# Distinct prescribers stay mergeable by summing because every dimension is a prescriber attribute (an NPI only
+# ever falls in one cell); a finer geography (county, ZIP) is another entry in dims under the same rule.
+
+STATE_COL = 'Prscrbr_State_Abrvtn'
+SPECIALTY_COL = 'Prscrbr_Type'
+RUCA_COL = 'ruca'
+
+GEO_ROLLUP = {
+    'name': 'opioids_geo_rollup',
+    'dims': [RUCA_COL, STATE_COL, SPECIALTY_COL],
+    'npi_col': 'PRSCRBR_NPI',
+}
+
+# partial -> (column, aggregation) over the prescriber rows; all of them merge by summing
+PARTIALS = {
+    'provider_count': ('PRSCRBR_NPI', 'nunique'),
+    'total_opioid_cost': ('Opioid_Tot_Drug_Cst', 'sum'),
+    'rate_sum': ('Opioid_Prscrbr_Rate', 'sum'),
+    'rate_count': ('Opioid_Prscrbr_Rate', 'count'),
+    'years_sum': ('years_experience', 'sum'),
+    'years_count': ('years_experience', 'count'),
+}
+
+
+def rollup_file(spec: dict) -> str:
+    return f"{spec['name']}.parquet"
+
+
+def rollup_columns(spec: dict):
+    '''Columns a rollup is computed from'''
+    return list(dict.fromkeys(spec['dims'] + [spec['npi_col']] + [col for col, _ in PARTIALS.values()]))
+
+
+def build_rollup(df: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    '''Partials of the prescriber rows grouped by the rollup dims (unknown values kept, so totals stay complete)'''
+    values = df[rollup_columns(spec)].copy()
+    for col in {col for col, func in PARTIALS.values() if func == 'sum'}:
+        values[col] = schema.for_summing(values[col])
+    return values.groupby(spec['dims'], observed=True, dropna=False).agg(**PARTIALS).reset_index()
+
+
+def rollup_artifact(spec: dict, source_file) -> derived.DerivedArtifact:
+    '''The rollup described by one of the *_ROLLUP specs, computed from source_file'''
+    return derived.DerivedArtifact(
+        rollup_file(spec), source_file, rollup_columns(spec),
+        build=lambda df: build_rollup(df, spec),
+        save=lambda rollup, path: rollup.to_parquet(path, index=False),
+        load=lambda path: schema.compact(pd.read_parquet(path)),
+        describe=lambda rollup: f"{len(rollup)} cells",
+    )
+
+
+def rollup_by(rollup: pd.DataFrame, dims, filters=None) -> pd.DataFrame:
+    '''Sums the partials of the rows matching the {column: value} filters into one row per value of dims'''
+    for col, value in (filters or {}).items():
+        rollup = rollup[rollup[col] == value]
+    return rollup.groupby(list(dims), observed=True)[list(PARTIALS)].sum().reset_index()
+
+
+def state_specialty(rollup: pd.DataFrame) -> pd.DataFrame:
+    '''The state x specialty partials the maps are drawn from'''
+    return rollup_by(rollup, [SPECIALTY_COL, STATE_COL])
+
+
+def finish_means(partials: pd.DataFrame) -> pd.DataFrame:
+    '''Turns summed partials into the prescribing_rate / years_exp means the maps show'''
+    partials = partials.copy()
+    partials['prescribing_rate'] = partials['rate_sum'] / partials['rate_count'].where(partials['rate_count'] > 0)
+    partials['years_exp'] = partials['years_sum'] / partials['years_count'].where(partials['years_count'] > 0)
+    return partials.drop(columns=['rate_sum', 'rate_count', 'years_sum', 'years_count'])
+
+
+def states_for(rollup: pd.DataFrame, specialties=None) -> pd.DataFrame:
+    '''One row per state for the given specialties (all specialties when None)'''
+    if specialties is not None:
+        rollup = rollup[rollup[SPECIALTY_COL].isin(specialties)]
+    return finish_means(rollup_by(rollup, [STATE_COL]))
+
+
+def specialty_facets(rollup: pd.DataFrame, specialties) -> pd.DataFrame:
+    '''One row per specialty per state, for a faceted map of the given specialties'''
+    return finish_means(rollup[rollup[SPECIALTY_COL].isin(specialties)])
+
+
+def ruca_for(rollup: pd.DataFrame, filters=None) -> pd.DataFrame:
+    '''One row per RUCA code (prescribers with no code left out) for the rows matching the filters'''
+    return finish_means(rollup_by(rollup, [RUCA_COL], filters))
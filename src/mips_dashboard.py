@@ -1,8 +1,12 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import os
 import psutil
+import data_access as dal
+import build_data
+import aggregate_cube as ac
+import sampling
+import schema
+import dashboard_utils as dbu
 
 
 #--- Page Config ---
@@ -12,40 +16,40 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded",
 )
-# --- 1. Load Data ---
-@st.cache_data
-def load_data():
-    # going to use absolute paths from root of the project, so it works when deployed
-    # return pd.read_parquet('../data/cleaned/df_master.parquet')
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    path_to_file = os.path.join(current_directory, '..','data','cleaned','df_master.parquet')
-    return pd.read_parquet(path_to_file)
-
-df = load_data()
-df = df.sample(n=20000,random_state=64)
-st.write(f"In-memory size: {df.memory_usage(deep=True).sum() / 1024**2:.2f} MB")
-
-def calculate_gender_distribution(the_df: pd.DataFrame) -> str:
-    '''Takes in the master DF and returns the number of unique M and F providers'''
-    genders = the_df[['NPI','gndr']]
-    #drop duplicate NPIs
-    genders = genders.drop_duplicates(subset=['NPI'])
-    gender_counts = genders.groupby('gndr')['NPI'].count().reset_index()
-    print(f"gender_counts = {gender_counts}")
-    try:
-        females = gender_counts.iloc[0, 1] / gender_counts['NPI'].sum() * 100
-    except IndexError:
-        females = 0
-    try:
-        males = gender_counts.iloc[1, 1] / gender_counts['NPI'].sum() * 100
-    except IndexError:
-        males = 0
-    return (f"{males:.1f}% : {females:.1f}%")
+dbu.start_trace('mips')
+
+# above this many filtered providers the histograms are estimated from the stratified sample instead
+HISTOGRAM_SAMPLE_THRESHOLD = 200_000
 
+# --- 1. Load Data ---
+# one row per NPI (built by build_data.py), so counts and means are per provider, not per measure.
+# Rows and aggregates come from the query backend (duckdb over the parquet files, or the in-memory pandas fallback)
+# read from the data manifest on every rerun, so a published refresh reaches running sessions without a
+# restart; every cache below is keyed by it
+DATASET_VERSION = dal.dataset_version(build_data.PROVIDERS_FILE)
+with dbu.profile('query backend', 'load'):
+    backend = dbu.load_query_backend(build_data.PROVIDERS_FILE, tuple(schema.MIPS_COLUMNS), tuple(schema.MIPS_FILTER_COLUMNS), DATASET_VERSION)
+# imports plotly in the background while the cube and sample load
+dbu.start_warmup('mips', DATASET_VERSION)
+
+@st.cache_resource(max_entries=2)
+def load_kpi_cube(_backend, dataset_version):
+    # precomputed by build_data.py (falls back to rolling up the provider rows if the cube hasn't been built)
+    return ac.cube_artifact(ac.MIPS_CUBE, build_data.PROVIDERS_FILE).load_or_build(_backend.select)
+
+@st.cache_resource(max_entries=2)
+def load_histogram_sample(_backend, dataset_version):
+    # st x pri_spec stratified sample drawn by build_data.py (drawn here if it hasn't been built)
+    return sampling.sample_artifact(sampling.MIPS_SAMPLE, build_data.PROVIDERS_FILE).load_or_build(_backend.select)
+
+with dbu.profile('kpi cube + histogram sample', 'load'):
+    kpi_cube = load_kpi_cube(backend, DATASET_VERSION)
+    histogram_sample = load_histogram_sample(backend, DATASET_VERSION)
+# filled in at the end of the run, once the backend has loaded what this rerun needed
+memory_line = st.empty()
 
 st.markdown('<h1 style="text-align: center; margin-bottom: 0.5rem;">Merit-Based Incentive Payment System (MIPS) Dashboard</h1>', unsafe_allow_html=True)
 st.markdown('<div style="text-align: center; font-size:15px; color:blue;">Explore trends and patterns in MIPS scores </div>', unsafe_allow_html=True)
-st.markdown('<div style="text-align: center; font-size:15px; color:lightblue;">Note: data is subsampled due to Streamlit cloud memory constraints. Full dataset is 25x larger.</div>', unsafe_allow_html=True)
 st.divider()
 
 
@@ -54,48 +58,52 @@ leftbar, vertical_divider, col1, col2 = st.columns([1,0.05,1,3],gap="large")
 
 leftbar.subheader("Filter Providers by:")
 
-states = ['All'] + sorted(df['st'].dropna().unique().tolist())
+states = ['All'] + dbu.selectbox_options(backend, build_data.PROVIDERS_FILE, 'st', DATASET_VERSION)
 selected_state = leftbar.selectbox("State", options=states, index=0)
 print(f"Selected state: {selected_state}")
 
-specialties = ['All'] + sorted(df['pri_spec'].dropna().unique().tolist())
+specialties = ['All'] + dbu.selectbox_options(backend, build_data.PROVIDERS_FILE, 'pri_spec', DATASET_VERSION)
 selected_specialty = leftbar.selectbox("Specialty", options=specialties, index=0)
 print(f"Selected specialty: {selected_specialty}")
 
-genders = ['All'] + sorted(df['gndr'].dropna().str.strip().unique().tolist())
+genders = ['All'] + dbu.selectbox_options(backend, build_data.PROVIDERS_FILE, 'gndr', DATASET_VERSION)
 selected_gender = leftbar.selectbox("Gender", options=genders, index=0)
 print(f"Selected gender: {selected_gender}")
 
-years_exp = ['All'] + sorted(df['years_experience'].dropna().unique().tolist())
+years_exp = ['All'] + dbu.selectbox_options(backend, build_data.PROVIDERS_FILE, 'years_experience', DATASET_VERSION)
 selected_years_exp = leftbar.selectbox("Years Experience", options=years_exp, index=0)
 print(f"Selected gender: {selected_years_exp}")
 
-med_school = ['All'] + sorted(df['Med_sch'].dropna().unique().tolist())
+med_school = ['All'] + dbu.selectbox_options(backend, build_data.PROVIDERS_FILE, 'Med_sch', DATASET_VERSION)
 selected_school = leftbar.selectbox("Medical School", options=med_school, index=0)
 print(f"Selected medical school: {selected_school}")
 
-size = ['All'] + sorted(df['num_org_mem'].dropna().unique().tolist())
+size = ['All'] + dbu.selectbox_options(backend, build_data.PROVIDERS_FILE, 'num_org_mem', DATASET_VERSION)
 selected_size = leftbar.selectbox("Practice Size", options=size, index=0)
 print(f"Selected size: {selected_size}")
 
-@st.cache_data
-def filter_data(df, state, specialty, gender, years_exp, med_school,practice_size):
-    filtered = df
-    if state != 'All':
-        filtered = filtered[filtered['st'] == state]
-    if specialty != 'All':
-        filtered = filtered[filtered['pri_spec'] == specialty]
-    if gender != 'All':
-        filtered = filtered[filtered['gndr'].str.strip() == gender]
-    if years_exp != 'All':
-        filtered = filtered[filtered['years_experience'] == years_exp]
-    if med_school != 'All':
-        filtered = filtered[filtered['Med_sch'] == med_school]
-    if practice_size != 'All':
-        filtered = filtered[filtered['num_org_mem'] == practice_size]
-    return filtered
-
-filtered_df = filter_data(df, selected_state, selected_specialty, selected_gender, selected_years_exp, selected_school, selected_size)
+def active_filters(state, specialty, gender, years_exp, med_school, practice_size):
+    '''Maps the selectbox values to {column: value}, leaving out the 'All' selections'''
+    selections = dict(zip(schema.MIPS_FILTER_COLUMNS, [state, specialty, gender, years_exp, med_school, practice_size]))
+    return {col: value for col, value in selections.items() if value != 'All'}
+
+def filter_data(filters):
+    '''Score columns of the providers matching the filters (pushed down to the query backend)'''
+    return backend.select(build_data.PROVIDERS_FILE, schema.MIPS_SCORE_COLUMNS, filters)
+
+def score_histograms(filters, provider_count):
+    '''Histograms over every filtered provider, or weighted estimates from the stratified sample for large subsets'''
+    if provider_count <= HISTOGRAM_SAMPLE_THRESHOLD:
+        return dbu.compute_histograms(filter_data(filters), schema.MIPS_SCORE_COLUMNS), None
+    sampled = histogram_sample.subset(filters)
+    return dbu.compute_histograms(sampled, schema.MIPS_SCORE_COLUMNS, weights=sampled['sample_weight']), sampled
+
+filters = active_filters(selected_state, selected_specialty, selected_gender, selected_years_exp, selected_school, selected_size)
+# the KPI cards are answered from the cube (provider rows only for filters the cube leaves out)
+with dbu.profile('kpi summary', 'aggregate') as record:
+    kpi_cells = kpi_cube.cells(filters, lambda columns, f: backend.select(build_data.PROVIDERS_FILE, columns, f))
+    kpi = ac.summarize(kpi_cells, kpi_cube.measures)
+    record['rows'] = len(kpi_cells)
 
 #add in memory usage
 process = psutil.Process(os.getpid())
@@ -136,53 +144,47 @@ with vertical_divider:
     )
 
 with col1:
-    metric_card("Number of Providers", filtered_df['NPI'].nunique(), color="#f2f6f7", text_color="#23272b")
-    metric_card("Average MIPS Score", f"{filtered_df['final_MIPS_score'].mean():.1f}", color="#f2f6f7", text_color="#23272b")
-    metric_card("Number of Specialties", filtered_df['pri_spec'].nunique(), color="#f2f6f7", text_color="#23272b")
-    metric_card("Males: Females", calculate_gender_distribution(filtered_df), color="#f2f6f7", text_color="#23272b")
-    metric_card("Average Years Experience", f"{filtered_df['years_experience'].mean():0.1f}", color="#f2f6f7", text_color="#23272b")
-    metric_card("Average Practice Size", f"{filtered_df['num_org_mem'].mean():0.1f}", color="#f2f6f7", text_color="#23272b")
-
-def make_mips_histogram(df, x_col, title, bar_color):
-    '''This function creates a histogram of the MIPS scores'''
-    fig = px.histogram(
-        df,
-        x=x_col,
-        nbins=110,
-        title=title,
-        marginal='box',  # Optional: adds a boxplot above
-        height=300,
-        width=500,
-        color_discrete_sequence=[bar_color]  # Use any hex color or named color
-    )
-    return fig
+    metric_card("Number of Providers", kpi.providers, color="#f2f6f7", text_color="#23272b")
+    metric_card("Average MIPS Score", f"{kpi.means['final_MIPS_score']:.1f}", color="#f2f6f7", text_color="#23272b")
+    metric_card("Number of Specialties", kpi.specialties, color="#f2f6f7", text_color="#23272b")
+    metric_card("Males: Females", kpi.gender_split(), color="#f2f6f7", text_color="#23272b")
+    metric_card("Average Years Experience", f"{kpi.means['years_experience']:0.1f}", color="#f2f6f7", text_color="#23272b")
+    metric_card("Average Practice Size", f"{kpi.means['num_org_mem']:0.1f}", color="#f2f6f7", text_color="#23272b")
 
 with col2:
-    plot_df = filtered_df.sample(n=2000) if len(filtered_df) > 2000 else filtered_df
-    fig1 = make_mips_histogram(plot_df, 'final_MIPS_score', "Distribution of Overall Scores",'#25b5b9')
-    st.plotly_chart(fig1, use_container_width=True)
+    with dbu.profile('score histograms', 'filter') as record:
+        histograms, sampled = score_histograms(filters, kpi.providers)
+        record['sampled_rows'] = None if sampled is None else len(sampled)
+    if sampled is not None:
+        # the sample's own estimate of the mean MIPS score, to show how far the histograms may be off
+        mean, standard_error = histogram_sample.estimate_mean(sampled, 'final_MIPS_score')
+        st.caption(f"Histograms estimated from a stratified sample of {len(sampled):,} of {kpi.providers:,} providers "
+                   f"(same sample on every rerun): sample mean MIPS score {mean:.1f} ± {1.96 * standard_error:.1f} "
+                   f"(95% interval, standard error {standard_error:.2f})")
+
+    with dbu.profile('histogram figures', 'figure'):
+        # independent figures, built concurrently by the figure pool and returned in order
+        fig1, fig2, fig3, fig4, fig5 = dbu.score_histogram_figures(histograms)
+
+    dbu.plotly_chart(fig1, 'fig1', use_container_width=True)
     st.markdown("- Key Insight: MIPS by design clusters most providers around similar scores (mean 80), so most providers appear the same)")
 
     #these show the breakdown in MIPS scores by Quality, PI, IA, and Cost
     subcol1, subcol2 = st.columns(2)
 
     with subcol1:
-        plot_df = filtered_df.sample(n=2000) if len(filtered_df) > 2000 else filtered_df
-       
-        fig2 = make_mips_histogram(plot_df, 'Quality_category_score', "Distribution of Quality Scores",'#b9c3eb')
-        st.plotly_chart(fig2, use_container_width=True)
+        dbu.plotly_chart(fig2, 'fig2', use_container_width=True)
 
-        fig3 = make_mips_histogram(plot_df, 'IA_category_score', "Distribution of Improvement Activities Scores",'#f83a3e')
-        st.plotly_chart(fig3, use_container_width=True)
+        dbu.plotly_chart(fig3, 'fig3', use_container_width=True)
         st.markdown("- Key Insight: Improvement Activity scores are all similar, but low (40)")
 
     with subcol2:
-        plot_df = filtered_df.sample(n=2000) if len(filtered_df) > 2000 else filtered_df
-        
-        fig4 = make_mips_histogram(plot_df, 'PI_category_score', "Distribution of Promoting Interoperability Scores",'#39c3eb')
-        st.plotly_chart(fig4, use_container_width=True)
+        dbu.plotly_chart(fig4, 'fig4', use_container_width=True)
         st.markdown("- Key Insight: Almost everyone scored very high (receiving credit often involves just checking boxes)")
 
-        fig5 = make_mips_histogram(plot_df, 'Cost_category_score', "Distribution of Cost Scores",'#fde23a')
-        st.plotly_chart(fig5, use_container_width=True)
+        dbu.plotly_chart(fig5, 'fig5', use_container_width=True)
+
+resident_bytes = backend.memory_usage() + kpi_cube.memory_usage() + histogram_sample.rows.memory_usage(deep=True).sum()
+memory_line.write(f"In-memory size: {resident_bytes / 1024**2:.2f} MB ({backend.name} backend + KPI cube + histogram sample)")
 
+dbu.show_trace()
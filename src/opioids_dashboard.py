@@ -1,9 +1,14 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import os
+from functools import partial
 import psutil
 import dashboard_utils as dbu
+import figure_pool
+import data_access as dal
+import aggregate_cube as ac
+import geo_aggregates as geo
+import build_data
+import schema
 
 
 #--- Page Config ---
@@ -13,82 +18,260 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded",
 )
+dbu.start_trace('opioids')
+
 # --- 1. Load Data ---
-@st.cache_data
-def load_data():
-    # going to use absolute paths from root of the project, so it works when deployed
-    # return pd.read_parquet('../data/cleaned/df_master.parquet')
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    path_to_file = os.path.join(current_directory, '..','data','cleaned','opioids_sample.parquet')
-    return pd.read_parquet(path_to_file)
-
-df = load_data()
-# df = df.sample(n=20000,random_state=64)
-# st.write(f"In-memory size: {df.memory_usage(deep=True).sum() / 1024**2:.2f} MB")
+# rows and aggregates come from the query backend (duckdb over the parquet file, or the in-memory pandas fallback)
+# changes whenever the data file is rebuilt (read from the data manifest on every rerun), so every cache below is keyed by it
+DATASET_VERSION = dal.dataset_version(build_data.OPIOIDS_FILE)
+with dbu.profile('query backend', 'load'):
+    backend = dbu.load_query_backend(build_data.OPIOIDS_FILE, tuple(schema.OPIOID_COLUMNS), tuple(schema.OPIOID_FILTER_COLUMNS), DATASET_VERSION)
+
+@st.cache_resource(max_entries=2)
+def load_kpi_cube(_backend, dataset_version):
+    # precomputed by build_data.py (falls back to rolling up the prescriber rows if the cube hasn't been built)
+    return ac.cube_artifact(ac.OPIOIDS_CUBE, build_data.OPIOIDS_FILE).load_or_build(_backend.select)
+
+@st.cache_data(max_entries=2)
+def load_geo_rollup(_backend, dataset_version):
+    # ruca x state x specialty partials built by build_data.py (rolled up from the prescriber rows if it hasn't been built)
+    return geo.rollup_artifact(geo.GEO_ROLLUP, build_data.OPIOIDS_FILE).load_or_build(_backend.select)
+
+@st.cache_data(max_entries=2)
+def load_state_specialty_rollup(_geo_rollup, dataset_version):
+    # level 1: the state x specialty partials (the geography rollup summed over ruca), once per dataset version
+    return geo.state_specialty(_geo_rollup)
+
+with dbu.profile('kpi cube + geography rollup', 'load'):
+    kpi_cube = load_kpi_cube(backend, DATASET_VERSION)
+    geo_rollup = load_geo_rollup(backend, DATASET_VERSION)
+    state_specialty = load_state_specialty_rollup(geo_rollup, DATASET_VERSION)
 
 st.markdown('<h1 style="text-align: center; margin-bottom: 0.5rem;">US Opioid Prescribing Patterns by Provider Specialty Dashboard</h1>', unsafe_allow_html=True)
 st.markdown('<div style="text-align: center; font-size:15px; color:blue;">Explore geospatial patterns in how narcotics are prescribed</div>', unsafe_allow_html=True)
 st.markdown('<div style="text-align: center; font-size:15px; color:gray;">Note: data is sampled due to Streamlit cloud memory constraints. Full dataset is 25x larger.</div>', unsafe_allow_html=True)
 st.divider()
 
-@st.cache_data
-def filter_data(df, state, specialty, gender, years_exp, med_school,practice_size):
-    filtered = df
-    if state != 'All':
-        filtered = filtered[filtered['st'] == state]
-    if specialty != 'All':
-        filtered = filtered[filtered['Prscrbr_Type'] == specialty]
-    if years_exp != 'All':
-        filtered = filtered[filtered['years_experience'] == years_exp]
-    return filtered
-
-#makes the main map you see (can filter by specialties, zoom in one specialty at a time)
-def make_filterable_by_specialty_cholorpeth(df,selected_theme):
-    opioids_specialties = df.groupby(['Prscrbr_Type','Prscrbr_State_Abrvtn']).agg(provider_count = ('PRSCRBR_NPI','count'),total_opioid_cost =('Opioid_Tot_Drug_Cst','sum'),prescribing_rate=('Opioid_Prscrbr_Rate','mean'),years_exp=('years_experience','mean'),state=('Prscrbr_State_Abrvtn','count')).reset_index()
-    opioids_specialties.Prscrbr_Type.nunique()
-    # internists = opioids_specialties[opioids_specialties['Prscrbr_Type'] == 'Internal Medicine']
-    print(f"opioids_specialties In-memory size: {opioids_specialties.memory_usage(deep=True).sum() / 1024**2:.2f} MB")
+def active_filters(state, specialty, years_exp):
+    '''Maps the selectbox values to {column: value}, leaving out the 'All' selections'''
+    selections = dict(zip(schema.OPIOID_FILTER_COLUMNS, [state, specialty, years_exp]))
+    return {col: value for col, value in selections.items() if value != 'All'}
+
+# level 2: rendered maps. The base figure only depends on the specialty; a theme change just patches the
+# color scale of the cached base instead of regrouping and rebuilding the whole figure
+@st.cache_data(max_entries=32)
+def specialty_map_base(_rollup, dataset_version, specialty):
+    specialties = None if specialty == 'All' else [specialty]
+    return dbu.make_filterable_by_specialty_cholorpeth(geo.states_for(_rollup, specialties), None)
+
+@st.cache_data(max_entries=128)
+def specialty_map(_rollup, dataset_version, specialty, theme):
+    fig = specialty_map_base(_rollup, dataset_version, specialty)
+    fig.update_coloraxes(colorscale=theme)
+    return fig
+
 
+#specialty groups compared against each other in the faceted maps
+surgical_specialties_list = ['Obstetrics & Gynecology','Ophthalmology','Otolaryngology','General Surgery','Orthopedic Surgery','Dentist','Urology','Thoracic Surgery','Surgical Oncology','Thoracic Surgery (Cardiothoracic Vascular Surgery)']
+medical_specialties_list = ['Pain Management','Dermatology','Psychiatry','Addiction Medicine','Emergency Medicine','Neurology','Cardiology','Hospitalist']
+primary_care_specialties_list = ['Internal Medicine','Nurse Practitioner','Family Practice','Physician Assistant']
+
+
+def make_choropleth(df,states_col, outcome_of_interest,col_to_facet,color_gradient,title):
+    '''makes a facted choloropeth map'''
+# color options: aggrnyl     agsunset    blackbody   bluered     blues       blugrn      bluyl       brwnyl
+# bugn        bupu        burg        burgyl      cividis     darkmint    electric    emrld
+# gnbu        greens      greys       hot         inferno     jet         magenta     magma
+# mint        orrd        oranges     oryel       peach       pinkyl      plasma      plotly3
+# pubu        pubugn      purd        purp        purples     purpor      rainbow     rdbu
+# rdpu        redor       reds        sunset      sunsetdark  teal        tealgrn     turbo
+# viridis     ylgn        ylgnbu      ylorbr      ylorrd      algae       amp         deep
+# dense       gray        haline      ice         matter      solar       speed       tempo
+# thermal     turbid      armyrose    brbg        earth       fall        geyser      prgn
+# piyg        picnic      portland    puor        rdgy        rdylbu      rdylgn      spectral
+# tealrose    temps       tropic      balance     curl        delta       oxy         edge
+# hsv         icefire     phase       twilight    mrybm       mygbm
+    import plotly.express as px
     fig = px.choropleth(
-        opioids_specialties,
-        locations='Prscrbr_State_Abrvtn',
+        df,  # long format: columns = ['state', 'specialty', 'rate']
         locationmode='USA-states',
-        color='prescribing_rate',
+        locations=states_col,
+        color=outcome_of_interest,
         scope='usa',
-        color_continuous_scale=selected_theme,
-        hover_name='Prscrbr_State_Abrvtn',
-        hover_data={
-            'provider_count': True,
-            'total_opioid_cost' : ':0.1f',
-            'years_exp': ':0.1f',
-        },
-        title='Opioid Prescribing Rate by Specialty',
-        labels={'provider_count': 'Number of Providers', 'prescribing_rate': 'Prescribing Rate','total_opioid_cost': 'Total Opioid Cost','years_exp' : 'Years of Experience'},
-        height=800,
-        width=1200
+        facet_col=col_to_facet,
+        facet_col_wrap=3,
+        # facet_col_spacing=0.02,
+        # facet_row_spacing=0.02,
+        height=1600,
+        width=1200,
+        color_continuous_scale=color_gradient,
+        title=title
     )
-    # Center the title
+
     fig.update_layout(
         title={
-            'text': "Opioid Prescribing Rates by Specialty",
+            'text': title,
             'x': 0.5,  # center title
             'xanchor': 'center',
             'yanchor': 'top',
-            'font' : {
-                'size' : 36
+            'font': {
+                'size': 36
             }
+        },
+        margin=dict(t=220, l=40, r=40, b=10)  # 🔺 t=top margin in pixels
+    )
+
+    return fig
+
+
+# the faceted maps only change when the data does: drawn from the state x specialty rollup (one row per
+# specialty per state, not every prescriber row) and persisted to disk across restarts
+@st.cache_data(max_entries=8, persist="disk")
+def specialty_group_map(_rollup, dataset_version, specialties, title):
+    facets = geo.specialty_facets(_rollup, specialties)
+    return make_choropleth(facets,'Prscrbr_State_Abrvtn','prescribing_rate','Prscrbr_Type','reds',title)
+
+
+#-- below the fold sections ---
+# Each section is a lazy expander (dbu.lazy_section) in its own fragment: a closed section runs nothing,
+# opening / closing one reruns just that fragment, and the figures inside come from builders memoized on
+# the inputs they really depend on (the dataset version, plus the specialty for the RUCA chart), so the theme
+# selectbox never rebuilds them.
+
+@st.cache_data(max_entries=2)
+def characteristics_scatters(_backend, dataset_version):
+    '''The three provider / patient characteristic density plots (they don't depend on any selectbox)'''
+    #scatteprlots of patient and provider factors' impact on prescribing rates
+    #look at num_org_mem, telehealth, years of experience, gndr , bene avg risk score vs prescribing rate
+    #drawn as density heatmaps (binned here), so they run on every prescriber instead of a sample
+    opioids_scatter = _backend.select(build_data.OPIOIDS_FILE, ['PRSCRBR_NPI','Opioid_Prscrbr_Rate','Bene_Avg_Risk_Scre','Bene_Avg_Age','years_experience'])
+
+    # built concurrently by the figure pool; each builder only gets the two columns it plots
+    def density_scatter(x_col, title, x_label):
+        return partial(dbu.make_density_scatter, opioids_scatter[[x_col, 'Opioid_Prscrbr_Rate']], x_col, 'Opioid_Prscrbr_Rate',
+                       title=title, labels={x_col: x_label, 'Opioid_Prscrbr_Rate': 'Opioid Prescriber Rate'})
+
+    years_exp_scatter, age_chart, sickness_chart = figure_pool.build_figures([
+        density_scatter('years_experience', 'Provider Years of Experience vs. Opioid Prescriber Rate', 'Provider Years of Experience'),
+        density_scatter('Bene_Avg_Age', 'Patient Age vs. Opioid Prescriber Rate', 'Average Patient Age'),
+        density_scatter('Bene_Avg_Risk_Scre', 'Patient Medical Complexity (Sickness) vs. Opioid Prescriber Rate',
+                        'Patient Medical Complexity (higher is sicker)'),
+    ])
+    return years_exp_scatter, age_chart, sickness_chart
+
+
+@st.cache_data(max_entries=32)
+def ruca_chart(_geo_rollup, dataset_version, specialty):
+    '''Distinct prescribers and mean prescribing rate per RUCA code for the selected specialty, and the bar chart of them'''
+    # summed from the geography rollup, so a specialty change never touches prescriber rows
+    filters = {} if specialty == 'All' else {geo.SPECIALTY_COL: specialty}
+    ruca_df = geo.ruca_for(_geo_rollup, filters)[['ruca', 'provider_count', 'prescribing_rate']]
+
+    # Create bar plot
+    import plotly.express as px
+    fig = px.bar(
+        ruca_df,
+        x='ruca',
+        y='prescribing_rate',
+        color='prescribing_rate',  # adds gradient coloring
+        text='provider_count',     # shows number of prescribers on the bar
+        color_continuous_scale='Viridis',  # choose from: 'Viridis', 'Cividis', 'Plasma', 'Blues', etc.
+        title='Opioid Prescribing Rate by Population Density',
+        labels={
+            'ruca': 'RUCA Code',
+            'prescribing_rate': 'Mean Opioid Prescribing Rate',
+            'provider_count': 'Number of Prescribers'
         }
+    )
 
+    # Prettify text on bars
+    fig.update_traces(texttemplate='%{text}', textposition='outside')
 
-)
-    return fig
+    # Clean layout
+    fig.update_layout(
+        yaxis_title='Mean Prescribing Rate %',
+        xaxis_title='Population density',
+        title_font_size=24,
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+        font=dict(size=10),
+        # margin=dict(t=80, b=40, l=60, r=40),
+        height=800,
+        width=400
+    )
+    return ruca_df, fig
+
+
+@dbu.fragment
+def specialty_groups_section():
+    section = dbu.lazy_section("Opioid Prescribing Rates by Specialty Group", key='specialty_groups_section')
+    with section:
+        if not section.open:
+            return
+        with dbu.profile('specialty group maps', 'figure'):
+            #compare surgical specialties against each other
+            surgical_specialties_map = specialty_group_map(state_specialty, DATASET_VERSION, surgical_specialties_list,
+                                            'Surgical Specialties: Opioid Prescribing Rates')
+            #compare medical specialties against each other
+            medical_specialties_map = specialty_group_map(state_specialty, DATASET_VERSION, medical_specialties_list,
+                                            'Medical Specialties: Opioid Prescribing Rates')
+            #compare primary care against each other
+            primary_care_specialties_map = specialty_group_map(state_specialty, DATASET_VERSION, primary_care_specialties_list,
+                                            'Primary Care: Opioid Prescribing Rates')
+
+        dbu.plotly_chart(surgical_specialties_map, 'surgical_specialties_map', use_container_width=True)
+        st.divider()
+        dbu.plotly_chart(medical_specialties_map, 'medical_specialties_map', use_container_width=True)
+        st.divider()
+        dbu.plotly_chart(primary_care_specialties_map, 'primary_care_specialties_map', use_container_width=True)
+
+
+@dbu.fragment
+def characteristics_section():
+    section = dbu.lazy_section("Provider and Patient Characteristics vs. Opioid Prescribing Rate", key='characteristics_section')
+    with section:
+        if not section.open:
+            return
+        with dbu.profile('characteristics scatters', 'figure'):
+            years_exp_scatter, age_chart, sickness_chart = characteristics_scatters(backend, DATASET_VERSION)
+        scattercol1, scattercol2 = st.columns(2)
+        with scattercol1:
+            dbu.plotly_chart(years_exp_scatter, 'years_exp_scatter', use_container_width=True)
+            dbu.plotly_chart(age_chart, 'age_chart', use_container_width=True)
+
+        with scattercol2:
+            dbu.plotly_chart(sickness_chart, 'sickness_chart', use_container_width=True)
+
+
+@dbu.fragment
+def practice_location_section(specialty):
+    #look at RUCA (population density vs prescribing rate), for the specialty picked in the sidebar
+    section = dbu.lazy_section("Provider Practice Location vs. Opioid Prescribing Rate", key='practice_location_section')
+    with section:
+        if not section.open:
+            return
+        with dbu.profile('ruca chart', 'aggregate'):
+            ruca_df, fig = ruca_chart(geo_rollup, DATASET_VERSION, specialty)
+        st.dataframe(ruca_df)
+        dbu.plotly_chart(fig, 'ruca_chart', use_container_width=True)
+
+
+# the sections' figures are built in the background on the first run, so opening a section hits a warm cache
+dbu.start_warmup('opioids', DATASET_VERSION, [
+    ('specialty group maps', lambda: [specialty_group_map(state_specialty, DATASET_VERSION, specialties, title) for specialties, title in [
+        (surgical_specialties_list, 'Surgical Specialties: Opioid Prescribing Rates'),
+        (medical_specialties_list, 'Medical Specialties: Opioid Prescribing Rates'),
+        (primary_care_specialties_list, 'Primary Care: Opioid Prescribing Rates')]]),
+    ('characteristics scatters', lambda: characteristics_scatters(backend, DATASET_VERSION)),
+    ('ruca chart', lambda: ruca_chart(geo_rollup, DATASET_VERSION, 'All')),
+])
 
 
 #--SIDEBAR--
 with st.sidebar:
     st.title("Filter by Specialty")
 
-    specialties = ['All'] + sorted(df['Prscrbr_Type'].dropna().unique().tolist())
+    specialties = ['All'] + dbu.selectbox_options(backend, build_data.OPIOIDS_FILE, 'Prscrbr_Type', DATASET_VERSION)
     selected_specialty = st.selectbox("Specialty", options=specialties, index=0)
     print(f"Selected specialty: {selected_specialty}")
 
@@ -104,8 +287,12 @@ with st.sidebar:
     selected_theme = st.selectbox("Theme", options=themes, index=0)
 
 
-    # filtered_df = filter_data(df, selected_state, selected_specialty, selected_gender, selected_years_exp, selected_school, selected_size)
-    filtered_df = filter_data(df, 'All', selected_specialty, 'All', 'All', 'All', 'All')
+    filters = active_filters('All', selected_specialty, 'All')
+    # the KPI cards are answered from the cube (prescriber rows only for filters the cube leaves out)
+    with dbu.profile('kpi summary', 'aggregate') as record:
+        kpi_cells = kpi_cube.cells(filters, lambda columns, f: backend.select(build_data.OPIOIDS_FILE, columns, f))
+        kpi = ac.summarize(kpi_cells, kpi_cube.measures)
+        record['rows'] = len(kpi_cells)
     st.divider()
 
     #add in memory usage
@@ -119,192 +306,20 @@ col1, col2 = st.columns([1,3],gap="large")
 
 
 with col1:
-    dbu.metric_card("Number of Providers", filtered_df['PRSCRBR_NPI'].nunique(), color="#f2f6f7", text_color="#23272b")
-    dbu.metric_card("Average Years Experience", f"{filtered_df['years_experience'].mean():0.1f}", color="#f2f6f7", text_color="#23272b")
-    dbu.metric_card("Average Opioid Prescribing Rate", f"{filtered_df['Opioid_Prscrbr_Rate'].mean():0.1f}%", color="#f2f6f7", text_color="#23272b")
+    dbu.metric_card("Number of Providers", kpi.providers, color="#f2f6f7", text_color="#23272b")
+    dbu.metric_card("Average Years Experience", f"{kpi.means['years_experience']:0.1f}", color="#f2f6f7", text_color="#23272b")
+    dbu.metric_card("Average Opioid Prescribing Rate", f"{kpi.means['Opioid_Prscrbr_Rate']:0.1f}%", color="#f2f6f7", text_color="#23272b")
 
 with col2:
     # st.dataframe(filtered_df)
-    filterable_specialties_map = make_filterable_by_specialty_cholorpeth(filtered_df, selected_theme)
-    st.plotly_chart(filterable_specialties_map, use_container_width=True)
+    with dbu.profile('specialty map', 'figure'):
+        filterable_specialties_map = specialty_map(state_specialty, DATASET_VERSION, selected_specialty, selected_theme)
+    dbu.plotly_chart(filterable_specialties_map, 'filterable_specialties_map', use_container_width=True)
 
     st.divider()
 
-    #make the surgical specialties comparison faceted cholorpeth chart
-    surgical_specialties_list = ['Obstetrics & Gynecology','Ophthalmology','Otolaryngology','General Surgery','Orthopedic Surgery','Dentist','Urology','Thoracic Surgery','Surgical Oncology','Thoracic Surgery (Cardiothoracic Vascular Surgery) ']
-    medical_specialties_list = ['Pain Management','Dermatology','Psychiatry','Addiction Medicine','Emergency Medicine','Neurology','Cardiology','Hospitalist']
-    primary_care_specialties_list = ['Internal Medicine','Nurse Practitioner','Family Practice','Physician Assistant']
-    surgical_specialties = df[df['Prscrbr_Type'].isin(surgical_specialties_list)]
-    medical_specialties = df[df['Prscrbr_Type'].isin(medical_specialties_list)]
-    primary_care_specialties = df[df['Prscrbr_Type'].isin(primary_care_specialties_list)]
-
-
-    def make_choropleth(df,states_col, outcome_of_interest,col_to_facet,color_gradient,title):
-        '''makes a facted choloropeth map'''
-    # color options: aggrnyl     agsunset    blackbody   bluered     blues       blugrn      bluyl       brwnyl
-    # bugn        bupu        burg        burgyl      cividis     darkmint    electric    emrld
-    # gnbu        greens      greys       hot         inferno     jet         magenta     magma
-    # mint        orrd        oranges     oryel       peach       pinkyl      plasma      plotly3
-    # pubu        pubugn      purd        purp        purples     purpor      rainbow     rdbu
-    # rdpu        redor       reds        sunset      sunsetdark  teal        tealgrn     turbo
-    # viridis     ylgn        ylgnbu      ylorbr      ylorrd      algae       amp         deep
-    # dense       gray        haline      ice         matter      solar       speed       tempo
-    # thermal     turbid      armyrose    brbg        earth       fall        geyser      prgn
-    # piyg        picnic      portland    puor        rdgy        rdylbu      rdylgn      spectral
-    # tealrose    temps       tropic      balance     curl        delta       oxy         edge
-    # hsv         icefire     phase       twilight    mrybm       mygbm
-        fig = px.choropleth(
-            df,  # long format: columns = ['state', 'specialty', 'rate']
-            locationmode='USA-states',
-            locations=states_col,
-            color=outcome_of_interest,
-            scope='usa',
-            facet_col=col_to_facet,
-            facet_col_wrap=3,
-            # facet_col_spacing=0.02,
-            # facet_row_spacing=0.02,
-            height=1600,
-            width=1200,
-            color_continuous_scale=color_gradient,
-            title=title
-        )
-
-        fig.update_layout(
-            title={
-                'text': title,
-                'x': 0.5,  # center title
-                'xanchor': 'center',
-                'yanchor': 'top',
-                'font': {
-                    'size': 36
-                }
-            },
-            margin=dict(t=220, l=40, r=40, b=10)  # 🔺 t=top margin in pixels
-        )
-
-        return fig
-
-    #compare surgical specialties against each other
-    surgical_specialties_map = make_choropleth(surgical_specialties,'Prscrbr_State_Abrvtn',
-                                    'Opioid_Prscrbr_Rate','Prscrbr_Type','reds','Surgical Specialties: Opioid Prescribing Rates')
-    st.plotly_chart(surgical_specialties_map, use_container_width=True)
-
-    st.divider()
-    #compare medical specialties against each other
-    medical_specialties_map = make_choropleth(medical_specialties,'Prscrbr_State_Abrvtn',
-                                    'Opioid_Prscrbr_Rate','Prscrbr_Type','reds','Medical Specialties: Opioid Prescribing Rates')
-    st.plotly_chart(medical_specialties_map, use_container_width=True)
-
-    st.divider()
-
-    #compare primary care against each other
-    primary_care_specialties_map = make_choropleth(primary_care_specialties,'Prscrbr_State_Abrvtn',
-                                    'Opioid_Prscrbr_Rate','Prscrbr_Type','reds','Primary Care: Opioid Prescribing Rates')
-    st.plotly_chart(primary_care_specialties_map, use_container_width=True)
-
-    st.divider()
-
-    st.header("Provider and Patient Characteristics vs. Opioid Prescribing Rate")
-
-    scattercol1, scattercol2 = st.columns(2)
-    with scattercol1:
-
-        #scatteprlots of patient and provider factors' impact on prescribing rates
-        #look at num_org_mem, telehealth, years of experience, gndr , bene avg risk score vs prescribing rate (scatterplots) #sample b/c it's too big
-        # opioids_sample= opioids_raw.sample(n=100000,random_state=64)
-        opioids_scatter = df[['PRSCRBR_NPI','Opioid_Prscrbr_Rate','Bene_Avg_Risk_Scre','Bene_Avg_Age','years_experience']]
-
-        print(f"opioids_scatter In-memory size: {opioids_scatter.memory_usage(deep=True).sum() / 1024**2:.2f} MB")
-        print(f"opiods scatter rows: {len(opioids_scatter)}")
-
-        years_exp_scatter = px.scatter(
-            opioids_scatter,
-            x='years_experience',
-            y='Opioid_Prscrbr_Rate',
-            opacity=0.1,
-            title='Provider Years of Experience vs. Opioid Prescriber Rate',
-            labels={
-                'years_experience': 'Provider Years of Experience',
-                'Opioid_Prscrbr_Rate': 'Opioid Prescriber Rate'
-            },
-            height=600,
-            width=600,
-            color_discrete_sequence=['blue']
-        )
-        st.plotly_chart(years_exp_scatter, use_container_width=True)
-
-        age_chart = px.scatter(
-            opioids_scatter,
-            x='Bene_Avg_Age',
-            y='Opioid_Prscrbr_Rate',
-            opacity=0.1,
-            title='Patient Age vs. Opioid Prescriber Rate',
-            labels={
-                'Bene_Avg_Age': 'Average Patient Age',
-                'Opioid_Prscrbr_Rate': 'Opioid Prescriber Rate'
-            },
-            height=600,
-            width=600,
-            color_discrete_sequence=['blue']
-        )
-        st.plotly_chart(age_chart, use_container_width=True)
-
-    with scattercol2:
-        sickness_chart = px.scatter(
-            opioids_scatter,
-            x='Bene_Avg_Risk_Scre',
-            y='Opioid_Prscrbr_Rate',
-            opacity=0.1,
-            title='Patient Medical Complexity (Sickness) vs. Opioid Prescriber Rate',
-            labels={
-                'Bene_Avg_Risk_Scre': 'Patient Medical Complexity (higher is sicker)',
-                'Opioid_Prscrbr_Rate': 'Opioid Prescriber Rate'
-            },
-            height=600,
-            width=600,
-            color_discrete_sequence=['blue']
-        )
-        st.plotly_chart(sickness_chart, use_container_width=True)
-
-    st.divider()
-
-    #look at RUCA (population density vs prescribing rate)
-    st.header("Provider Practice Location vs. Opioid Prescribing Rate")
-
-    ruca_df = df.groupby('ruca').agg(count=('PRSCRBR_NPI','count'),prescribing_rate=('Opioid_Prscrbr_Rate','mean'))
-    ruca_df = ruca_df.reset_index()
-    ruca_df
-
-    # Create bar plot
-    fig = px.bar(
-        ruca_df,
-        x='ruca',
-        y='prescribing_rate',
-        color='prescribing_rate',  # adds gradient coloring
-        text='count',              # shows number of prescribers on the bar
-        color_continuous_scale='Viridis',  # choose from: 'Viridis', 'Cividis', 'Plasma', 'Blues', etc.
-        title='Opioid Prescribing Rate by Population Density',
-        labels={
-            'ruca': 'RUCA Code',
-            'prescribing_rate': 'Mean Opioid Prescribing Rate',
-            'count': 'Number of Prescribers'
-        }
-    )
-
-    # Prettify text on bars
-    fig.update_traces(texttemplate='%{text}', textposition='outside')
-
-    # Clean layout
-    fig.update_layout(
-        yaxis_title='Mean Prescribing Rate %',
-        xaxis_title='Population density',
-        title_font_size=24,
-        plot_bgcolor='white',
-        paper_bgcolor='white',
-        font=dict(size=10),
-        # margin=dict(t=80, b=40, l=60, r=40),
-        height=800,
-        width=400
-    )
+    specialty_groups_section()
+    characteristics_section()
+    practice_location_section(selected_specialty)
 
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+dbu.show_trace()
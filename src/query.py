@@ -0,0 +1,154 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import data_access as dal
+import schema
+from filter_index import FilterIndex
+
+try:
+    import duckdb
+except ImportError:  # optional: without it every query runs on the in-memory pandas frames
+    duckdb = None
+
+#-- Dashboard query API ---
+# Both dashboards ask for rows through a backend instead of slicing DataFrames directly (aggregates come from
+# the precomputed cubes / rollups, see derived.py):
+#   select(table, columns, filters)  -> filtered rows of just those columns
+#   distinct(table, col)             -> sorted non null values (selectbox options)
+# filters are {column: value} equality filters (a list/tuple value means "any of").
+#
+# DuckDBBackend runs the SQL straight over the parquet files (predicate + projection pushdown, scans spread
+# over every core) so the Streamlit process doesn't hold the dataset. PandasBackend is the fallback: frames
+# loaded through data_access and filtered with a FilterIndex.
+# Pick one with DASHBOARD_QUERY_BACKEND=duckdb|pandas (default: duckdb when it is installed).
+
+def backend_name():
+    '''Which backend to use: DASHBOARD_QUERY_BACKEND, else duckdb when it is installed'''
+    name = os.environ.get('DASHBOARD_QUERY_BACKEND')
+    if name:
+        return name
+    return 'duckdb' if duckdb is not None else 'pandas'
+
+
+class PandasBackend:
+    '''Queries in-memory frames (loaded on first use), filtered through a FilterIndex'''
+    name = 'pandas'
+
+    def __init__(self, tables: dict):
+        # table -> (columns to load, columns to index)
+        self.tables = tables
+        # table -> (frame, its FilterIndex), published together once both are built
+        self.loaded = {}
+        # sessions share the backend (dbu.load_query_backend), so one of them loads a table while the others wait
+        self.lock = threading.Lock()
+
+    def load(self, table):
+        '''The frame of a table and its FilterIndex, loaded on first use'''
+        loaded = self.loaded.get(table)
+        if loaded is None:
+            with self.lock:
+                loaded = self.loaded.get(table)
+                if loaded is None:
+                    columns, index_columns = self.tables[table]
+                    frame = dal.load_dataframe(table, list(columns))
+                    loaded = self.loaded[table] = (frame, FilterIndex(frame, index_columns))
+        return loaded
+
+    def frame(self, table) -> pd.DataFrame:
+        return self.load(table)[0]
+
+    def rows(self, table, filters):
+        '''Row positions matching the filters (indexed equality filters first, the rest checked on those rows)'''
+        filters = filters or {}
+        frame, index = self.load(table)
+        indexed = {col: value for col, value in filters.items()
+                   if col in index.entries and not isinstance(value, (list, tuple))}
+        rows = index.select(indexed)
+        for col, value in filters.items():
+            if col not in indexed:
+                values = value if isinstance(value, (list, tuple)) else [value]
+                rows = rows[frame[col].iloc[rows].isin(values).to_numpy()]
+        return rows
+
+    def select(self, table, columns, filters=None) -> pd.DataFrame:
+        frame = self.frame(table)
+        rows = self.rows(table, filters)
+        if len(rows) == len(frame):
+            return frame[list(columns)]
+        return frame[list(columns)].iloc[rows]
+
+    def distinct(self, table, col):
+        return sorted(self.frame(table)[col].dropna().unique().tolist())
+
+    def memory_usage(self):
+        '''Bytes of table data held in this process'''
+        return int(sum(frame.memory_usage(deep=True).sum() for frame, _ in self.loaded.values()))
+
+
+class DuckDBBackend:
+    '''Runs each query as SQL directly over the cleaned parquet files'''
+    name = 'duckdb'
+
+    def __init__(self, threads=None):
+        self.connection = duckdb.connect()
+        if threads:
+            self.connection.execute(f"SET threads TO {int(threads)}")
+
+    def source(self, table):
+        # the part files of the published version (a partitioned table's directory can also hold other releases)
+        files = ', '.join("'{}'".format(path.replace("'", "''")) for path in dal.table_files(table))
+        return f"read_parquet([{files}])"
+
+    def where(self, filters):
+        clauses, params = [], []
+        for col, value in (filters or {}).items():
+            # compared as stored, so parquet min / max statistics can skip row groups; the build strips text columns
+            # like the selectbox values (schema.compact), and a data dir written before it did is rebuilt with
+            # `python src/build_data.py split`
+            column = f'"{col}"'
+            if isinstance(value, (list, tuple)):
+                clauses.append(f'{column} IN ({", ".join("?" for _ in value)})')
+                params.extend(value)
+            else:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), [to_python(value) for value in params]
+
+    def run(self, sql, params) -> pd.DataFrame:
+        # a cursor per query, since Streamlit serves each session from its own thread
+        return schema.compact(self.connection.cursor().execute(sql, params).df())
+
+    def select(self, table, columns, filters=None) -> pd.DataFrame:
+        where, params = self.where(filters)
+        select_list = ', '.join(f'"{col}"' for col in columns)
+        return self.run(f'SELECT {select_list} FROM {self.source(table)}{where}', params)
+
+    def distinct(self, table, col):
+        values = self.run(f'SELECT DISTINCT "{col}" FROM {self.source(table)} WHERE "{col}" IS NOT NULL', [])
+        return sorted(values[col].dropna().unique().tolist())
+
+    def memory_usage(self):
+        '''Bytes held by DuckDB's buffer manager (the tables themselves stay on disk)'''
+        try:
+            used = self.run('SELECT sum(memory_usage_bytes) AS used FROM duckdb_memory()', [])['used'].iloc[0]
+        except duckdb.Error:  # duckdb_memory() is not in older duckdb releases
+            return 0
+        return int(used) if pd.notna(used) else 0
+
+
+def to_python(value):
+    '''numpy scalars (e.g. from a selectbox built off a numpy column) as plain python values for SQL params'''
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def make_backend(tables: dict, name=None):
+    '''Builds the configured backend; tables (table -> (columns, index columns)) is used by the pandas fallback'''
+    name = name or backend_name()
+    if name == 'duckdb':
+        if duckdb is None:
+            raise ImportError("DASHBOARD_QUERY_BACKEND=duckdb but the duckdb package is not installed")
+        return DuckDBBackend(os.environ.get('DASHBOARD_QUERY_THREADS'))
+    if name != 'pandas':
+        raise ValueError(f"unknown query backend {name!r} (expected 'duckdb' or 'pandas')")
+    return PandasBackend(tables)
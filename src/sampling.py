@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import derived
+import schema
+
+#-- Stratified sample ---
+# Build time, deterministic bottom-k sample per stratum (st x pri_spec for the MIPS providers): every row gets a
+# rank from a hash of its NPI, and the k lowest ranked rows of each stratum are kept. The same providers are
+# drawn on every run and rerun (no flicker), and each kept row carries the weight (stratum size / rows kept)
+# needed to turn sample counts back into provider counts.
+#
+# The sample has a fixed total budget, split across strata in proportion to their size (at least one row each),
+# so it stays small however many strata there are. It is only used for filtered subsets of more than
+# HISTOGRAM_SAMPLE_THRESHOLD providers (mips_dashboard.py), which get at least budget x threshold / providers
+# rows (4,000 at 1M providers), and a scan of it is cheap.
+#
+# Any filtered subset of the sample is still a uniform sample within each stratum, so a filter is served by
+# slicing the stored rows instead of resampling. estimate_mean gives a subset's weighted mean with its standard
+# error, so a page can say how far its estimates may be off.
+
+# rows kept in total
+SAMPLE_ROWS = 20_000
+
+MIPS_SAMPLE = {
+    'name': 'providers_sample',
+    'strata': ['st', 'pri_spec'],
+    'key_col': 'NPI',
+    'columns': ['gndr', 'years_experience', 'Med_sch', 'num_org_mem', 'final_MIPS_score', 'Quality_category_score',
+                'IA_category_score', 'PI_category_score', 'Cost_category_score'],
+}
+
+
+def sample_rank(keys: pd.Series) -> np.ndarray:
+    '''Deterministic pseudo-random rank in [0, 1) for each key (same key -> same rank on every build)'''
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy() / 2.0 ** 64
+
+
+def sample_file(spec: dict) -> str:
+    return f"{spec['name']}.parquet"
+
+
+def sample_columns(spec: dict):
+    '''Columns a sample is drawn from'''
+    return list(dict.fromkeys(spec['strata'] + spec['columns'] + [spec['key_col']]))
+
+
+class StratifiedSample:
+    '''Bottom-k rows of each stratum, sorted by stratum then rank, with their stratum sizes and k (stratum_quota)'''
+
+    def __init__(self, rows: pd.DataFrame, strata):
+        self.rows = rows
+        self.strata = list(strata)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, strata, key_col, total_rows=None):
+        fraction = min(1.0, (total_rows or SAMPLE_ROWS) / max(len(df), 1))
+        ranked = df.assign(sample_rank=sample_rank(df[key_col])).sort_values('sample_rank', kind='stable')
+        groups = ranked.groupby(list(strata), observed=True, dropna=False, sort=False)
+        ranked['stratum_size'] = groups['sample_rank'].transform('size')
+        ranked['stratum_rank'] = groups.cumcount()
+        ranked['stratum_quota'] = np.ceil(ranked['stratum_size'] * fraction).astype('int64')
+        rows = ranked[ranked['stratum_rank'] < ranked['stratum_quota']].copy()
+        rows['sample_weight'] = rows['stratum_size'] / rows['stratum_quota']
+        rows = rows.sort_values(list(strata) + ['stratum_rank']).reset_index(drop=True)
+        return cls(rows, strata)
+
+    def subset(self, filters: dict) -> pd.DataFrame:
+        '''Sample rows matching the filters'''
+        rows = self.rows
+        mask = np.ones(len(rows), dtype=bool)
+        for col, value in (filters or {}).items():
+            mask &= (rows[col] == value).to_numpy(dtype=bool, na_value=False)
+        return rows[mask]
+
+    def estimate_mean(self, rows: pd.DataFrame, col) -> tuple:
+        '''Weighted mean of a column over sample rows (e.g. a subset) and the estimate's standard error
+
+        Stratified estimator: the rows of each stratum stand for sample_weight times as many providers, and the
+        variance adds up the within-stratum variances with the finite population correction (1 - k / stratum
+        size). A stratum with a single row in the subset adds no variance, so for very thin subsets the standard
+        error is an underestimate.'''
+        rows = rows[rows[col].notna()]
+        groups = rows.groupby(self.strata, observed=True, dropna=False)
+        stats = pd.DataFrame({'rows': groups[col].size(), 'mean': groups[col].mean(),
+                              'var': groups[col].var(ddof=1).fillna(0.0), 'weight': groups['sample_weight'].first()})
+        providers = stats['rows'] * stats['weight']
+        shares = providers / providers.sum()
+        mean = (shares * stats['mean']).sum()
+        variance = (shares ** 2 * (1 - 1 / stats['weight']) * stats['var'] / stats['rows']).sum()
+        return float(mean), float(np.sqrt(variance))
+
+    def save(self, path):
+        self.rows.to_parquet(path, index=False)
+
+    @classmethod
+    def load(cls, path, strata):
+        return cls(schema.compact(pd.read_parquet(path)), strata)
+
+
+def build_sample(df: pd.DataFrame, spec: dict, total_rows=None) -> StratifiedSample:
+    '''Draws the sample described by one of the *_SAMPLE specs'''
+    return StratifiedSample.build(df[sample_columns(spec)], spec['strata'], spec['key_col'], total_rows)
+
+
+def sample_artifact(spec: dict, source_file) -> derived.DerivedArtifact:
+    '''The sample described by one of the *_SAMPLE specs, drawn from source_file'''
+    return derived.DerivedArtifact(
+        sample_file(spec), source_file, sample_columns(spec),
+        build=lambda df: build_sample(df, spec),
+        save=StratifiedSample.save,
+        load=lambda path: StratifiedSample.load(path, spec['strata']),
+        describe=lambda sample: f"{len(sample.rows)} rows",
+        # samples drawn before the total row budget have no stratum_quota
+        is_compatible=lambda path: 'stratum_quota' in pq.read_schema(path).names,
+    )
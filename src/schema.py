@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+#-- Column schema ---
+# The raw CMS files are read as strings, so without this every filter column is a python object string and
+# every score a nullable Float64. compact() gives the dashboards dictionary-encoded categoricals for the
+# filter columns, narrow ints for the small counts and float32 scores.
+
+# low-cardinality strings used by the selectboxes / groupbys
+CATEGORY_COLUMNS = ['st', 'pri_spec', 'gndr', 'Med_sch', 'Prscrbr_Type', 'Prscrbr_State_Abrvtn', 'ruca']
+
+#-- Dashboard columns ---
+# what each page reads (only these columns are ever loaded) and filters on, shared with benchmark.py
+MIPS_COLUMNS = ['NPI', 'st', 'pri_spec', 'gndr', 'years_experience', 'Med_sch', 'num_org_mem',
+                'final_MIPS_score', 'Quality_category_score', 'PI_category_score', 'IA_category_score', 'Cost_category_score']
+# selectbox column for each filter of the MIPS page, in the order of its active_filters arguments
+MIPS_FILTER_COLUMNS = ['st', 'pri_spec', 'gndr', 'years_experience', 'Med_sch', 'num_org_mem']
+# the five score histograms, binned together over every filtered provider
+MIPS_SCORE_COLUMNS = ['final_MIPS_score', 'Quality_category_score', 'IA_category_score', 'PI_category_score', 'Cost_category_score']
+
+OPIOID_COLUMNS = ['PRSCRBR_NPI', 'Prscrbr_Type', 'Prscrbr_State_Abrvtn', 'Opioid_Tot_Drug_Cst', 'Opioid_Prscrbr_Rate',
+                  'years_experience', 'Bene_Avg_Risk_Scre', 'Bene_Avg_Age', 'ruca']
+# selectbox column for the state, specialty and years of experience filters of the opioids page
+OPIOID_FILTER_COLUMNS = ['Prscrbr_State_Abrvtn', 'Prscrbr_Type', 'years_experience']
+
+# small integer counts (nullable, since not every provider reports them)
+INT_COLUMNS = {
+    'years_experience': 'Int16',
+    'num_org_mem': 'Int32',
+}
+ARROW_INT_TYPES = {'Int16': pa.int16(), 'Int32': pa.int32()}
+PANDAS_INT_TYPES = {arrow_type: pd.api.types.pandas_dtype(dtype) for dtype, arrow_type in ARROW_INT_TYPES.items()}
+
+# scores / rates / averages that don't need double precision (costs stay float64 because they get summed)
+FLOAT32_COLUMNS = ['final_MIPS_score', 'final_MIPS_score_without_CPB', 'Quality_category_score', 'PI_category_score',
+                   'IA_category_score', 'Cost_category_score', 'Opioid_Prscrbr_Rate', 'Bene_Avg_Risk_Scre', 'Bene_Avg_Age']
+
+
+def strip_categories(col: pd.Series) -> pd.Series:
+    '''Turns a string column into a categorical with whitespace stripped from its values (returned as is if it
+    already is one)'''
+    if not isinstance(col.dtype, pd.CategoricalDtype):
+        col = col.astype('category')
+    if not pd.api.types.is_string_dtype(col.cat.categories):
+        return col
+    stripped = col.cat.categories.str.strip()
+    if stripped.equals(col.cat.categories):
+        return col
+    # stripping can merge categories ('F' and 'F '), so remap the codes rather than renaming
+    categories, inverse = np.unique(stripped, return_inverse=True)
+    codes = col.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, inverse[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=col.index, name=col.name)
+
+
+def compact(df: pd.DataFrame) -> pd.DataFrame:
+    '''Converts the known dashboard columns to compact dtypes (columns that aren't present, or already have
+    their compact dtype, are left alone)'''
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            column = df[col]
+            stripped = strip_categories(column)
+            if stripped is not column:
+                df[col] = stripped
+    for col, dtype in INT_COLUMNS.items():
+        if col in df.columns and df[col].dtype != dtype:
+            df[col] = pd.to_numeric(df[col], errors='coerce').round().astype(dtype)
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns and df[col].dtype != 'float32':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+    return df
+
+
+def for_summing(col: pd.Series) -> pd.Series:
+    '''A compact column as float64, so sums neither lose precision (float32) nor overflow (Int16 / Int32)'''
+    return col.astype('float64')
+
+
+def strip_strings(chunk: pd.DataFrame) -> pd.DataFrame:
+    '''Strips whitespace from every string column (done once at build time)'''
+    for col in chunk.columns:
+        if pd.api.types.is_string_dtype(chunk[col]) or chunk[col].dtype == object:
+            chunk[col] = chunk[col].str.strip()
+    return chunk
+
+
+#-- Arrow side ---
+# The memory-mapped Arrow mirror (data_access.py) is written with the same compact types, so pandas can
+# wrap the numeric buffers without copying and the categoricals come straight from the dictionaries.
+
+def is_text(arrow_type) -> bool:
+    '''Plain or dictionary encoded strings'''
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+
+
+def compact_arrow_schema(arrow_schema: pa.Schema) -> pa.Schema:
+    '''Compact Arrow types for the known dashboard columns'''
+    fields = []
+    for field in arrow_schema:
+        if field.name in CATEGORY_COLUMNS and is_text(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        elif field.name in INT_COLUMNS:
+            field = field.with_type(ARROW_INT_TYPES[INT_COLUMNS[field.name]])
+        elif field.name in FLOAT32_COLUMNS:
+            field = field.with_type(pa.float32())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def stripped_text(column) -> pa.Array:
+    '''A string (or dictionary of strings) column as plain strings with whitespace stripped'''
+    return pc.utf8_trim_whitespace(column.cast(pa.string()))
+
+
+def category_dictionary(column) -> pa.Array:
+    '''Sorted, whitespace stripped distinct values of a string column (one dictionary for the whole file)'''
+    values = pc.unique(stripped_text(column)).drop_null()
+    return values.take(pc.sort_indices(values))
+
+
+def compact_batch(batch: pa.RecordBatch, target: pa.Schema, dictionaries: dict) -> pa.RecordBatch:
+    '''Casts a batch to the compact schema, encoding categories against the shared file dictionaries'''
+    columns = []
+    for field in target:
+        column = batch.column(field.name)
+        if field.name in dictionaries:
+            dictionary = dictionaries[field.name]
+            indices = pc.index_in(stripped_text(column), value_set=dictionary).cast(pa.int32())
+            column = pa.DictionaryArray.from_arrays(indices, dictionary)
+        elif pa.types.is_integer(field.type) and pa.types.is_floating(column.type):
+            column = pc.round(column).cast(field.type)
+        else:
+            column = column.cast(field.type)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=target)
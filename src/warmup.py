@@ -0,0 +1,209 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.request
+from functools import partial
+import psutil
+import data_access as dal
+
+#-- Warm-up ---
+# Cold start work is moved off the first page view:
+#   at boot    `python src/warmup.py` (run next to `streamlit run`, see .devcontainer) rebuilds stale cubes,
+#              samples and rollups and reads the files the query backend scans once so they sit in the OS page
+#              cache, which both dashboard processes share (the parquet parts for duckdb; the Arrow mirrors,
+#              converted first if needed, for the pandas backend). Given `--server URL`, it then waits for that
+#              dashboard server and opens one headless session on it, which runs the page in the server process
+#   in process each page starts a background thread on its first run (dbu.start_warmup) that imports plotly
+#              and fills the page's figure caches, so later views and opened sections hit warm caches; with
+#              --server that first run is the boot session above, not the first visitor
+# Each step records its progress in a small status file; `python src/warmup.py --status` prints them and exits
+# 0 only when all of them are ready, so it doubles as a readiness probe.
+# A status file is stamped with the machine's boot id, the pid that wrote it and the dataset versions it warmed,
+# and reads as cold once any of them is stale: after a reboot or a data refresh, once the process holding an
+# in-memory warm-up is gone, or when a warm-up died half way.
+# The status files go in DASHBOARD_WARMUP_DIR (default: the data dir).
+
+# imported in the background instead of on the first page view
+HEAVY_MODULES = ['plotly.express', 'plotly.graph_objects', 'plotly.subplots']
+
+# how long --server waits for a dashboard server to come up, and then for its page warm-up
+SERVER_TIMEOUT = 600
+
+
+def status_dir():
+    return os.environ.get('DASHBOARD_WARMUP_DIR', dal.DATA_DIR)
+
+
+def status_path(name):
+    return os.path.join(status_dir(), f'warmup-{name}.json')
+
+
+def boot_id():
+    '''Changes on every reboot of the machine'''
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return str(int(psutil.boot_time()))
+
+
+def dataset_versions() -> dict:
+    import build_data
+    return {table: dal.dataset_version(table) for table in (build_data.PROVIDERS_FILE, build_data.OPIOIDS_FILE)
+            if os.path.exists(dal.data_path(table))}
+
+
+def write_status(name, state, scope='process', **details):
+    '''Atomically records the state (warming / ready / failed) of one warm-up
+
+    scope is 'boot' for work that outlives the process (files, the page cache, another process' caches) and
+    'process' for the caches of the process itself, which are gone with it'''
+    path = status_path(name)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'state': state, 'updated': time.time(), 'pid': os.getpid(), 'scope': scope, 'boot': boot_id(),
+                   'versions': dataset_versions(), **details}, f)
+    os.replace(tmp_path, path)
+
+
+def is_stale(status) -> bool:
+    '''Whether a status no longer describes this boot, these datasets or a live process'''
+    if status.get('boot') != boot_id() or status.get('versions') != dataset_versions():
+        return True
+    # a process scoped warm-up dies with its process; a warm-up left 'warming' by a dead one never finishes
+    if status.get('scope') != 'boot' or status['state'] == 'warming':
+        return not psutil.pid_exists(status.get('pid', -1))
+    return False
+
+
+def read_status(name) -> dict:
+    '''The recorded status of a warm-up, {'state': 'cold'} when there is none or it is stale'''
+    try:
+        with open(status_path(name)) as f:
+            status = json.load(f)
+    except FileNotFoundError:
+        return {'state': 'cold'}
+    return {'state': 'cold'} if is_stale(status) else status
+
+
+def all_statuses() -> dict:
+    '''Status of every warm-up that has run against this data dir'''
+    names = [file[len('warmup-'):-len('.json')] for file in sorted(os.listdir(status_dir()))
+             if file.startswith('warmup-') and file.endswith('.json')]
+    return {name: read_status(name) for name in names}
+
+
+def import_heavy_modules():
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+
+
+def prime_page_cache(path, block_size=1 << 22):
+    '''Reads a file once so its pages are resident before the first query touches them'''
+    with open(path, 'rb') as f:
+        while f.read(block_size):
+            pass
+
+
+def warm_data():
+    '''Disk side warm-up: stale derived artifacts and the page cache of the files the query backend reads'''
+    import build_data
+    import query
+    build_data.build_derived(dal.DATA_DIR)
+    for table in (build_data.PROVIDERS_FILE, build_data.OPIOIDS_FILE):
+        if not os.path.exists(dal.data_path(table)):
+            continue
+        # only the pandas backend reads the Arrow mirror; duckdb scans the parquet parts
+        files = [dal.ensure_arrow_file(table)] if query.backend_name() == 'pandas' else dal.table_files(table)
+        for path in files:
+            prime_page_cache(path)
+
+
+def wait_for_server(url, timeout=SERVER_TIMEOUT):
+    '''Polls a dashboard server's health endpoint until it answers'''
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f'{url}/_stcore/health', timeout=5):
+                return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(1)
+
+
+def warm_server(url, timeout=SERVER_TIMEOUT):
+    '''Runs a dashboard server's page once through a headless session, then waits for its page warm-up'''
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    from websockets.sync.client import connect
+    wait_for_server(url, timeout)
+    # what a browser does when it opens the page: connect, ask for a run and read messages until it is over
+    with connect(f"ws{url[len('http'):]}/_stcore/stream", subprotocols=['streamlit'], max_size=None) as session:
+        rerun = BackMsg()
+        rerun.rerun_script.query_string = ''
+        session.send(rerun.SerializeToString())
+        while True:
+            message = ForwardMsg()
+            message.ParseFromString(session.recv(timeout=timeout))
+            if message.WhichOneof('type') == 'script_finished':
+                break
+    # that run started the page's warm-up thread (dbu.start_warmup), which is 'warming' until it is done
+    deadline = time.time() + timeout
+    while any(status['state'] == 'warming' and status.get('scope') == 'process' for status in all_statuses().values()):
+        if time.time() > deadline:
+            raise TimeoutError(f'{url}: page warm-up still running after {timeout}s')
+        time.sleep(0.5)
+
+
+def run(name, steps, scope='process'):
+    '''Runs (label, callable) steps in order, recording progress in the status file'''
+    started = time.time()
+    done = []
+    write_status(name, 'warming', scope, started=started, done=done)
+    try:
+        for label, step in steps:
+            step()
+            done.append(label)
+            write_status(name, 'warming', scope, started=started, done=done)
+    except Exception:
+        write_status(name, 'failed', scope, started=started, done=done, error=traceback.format_exc(limit=3))
+        raise
+    write_status(name, 'ready', scope, started=started, done=done, seconds=round(time.time() - started, 2))
+
+
+def background_thread(name, steps) -> threading.Thread:
+    '''Daemon thread (not started yet) that runs the steps; errors end up in the status file'''
+    # recorded before the thread starts, so the run that starts it never ends with the warm-up looking idle
+    write_status(name, 'warming')
+
+    def target():
+        try:
+            run(name, steps)
+        except Exception:
+            pass
+    return threading.Thread(target=target, name=f'warmup-{name}', daemon=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm the dashboard data before the first page view')
+    parser.add_argument('--status', action='store_true', help='print the warm-up status; exit 0 only when all are ready')
+    parser.add_argument('--server', action='append', default=[],
+                        help='base url of a dashboard server whose page to run once after the data (repeatable)')
+    args = parser.parse_args()
+    if args.status:
+        statuses = all_statuses()
+        print(json.dumps(statuses, indent=1))
+        sys.exit(0 if statuses and all(status['state'] == 'ready' for status in statuses.values()) else 1)
+    run('data', [('data', warm_data)], scope='boot')
+    if args.server:
+        run('servers', [(url, partial(warm_server, url.rstrip('/'))) for url in args.server], scope='boot')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are flat in src/ and import each other by name, as they do when streamlit runs a page
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
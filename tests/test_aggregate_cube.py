@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import aggregate_cube as ac
+
+SPEC = {
+    'name': 'test_cube',
+    'base_dims': ['pri_spec', 'gndr'],
+    'filter_dims': ['st'],
+    'measures': ['final_MIPS_score', 'years_experience'],
+    'npi_col': 'NPI',
+}
+
+
+@pytest.fixture(scope='module')
+def df():
+    rng = np.random.default_rng(1)
+    rows = 3_000
+    score = rng.uniform(0, 100, rows)
+    score[rng.random(rows) < 0.1] = np.nan
+    # one row per provider, like the providers table (the cube relies on an NPI falling in one cell)
+    return pd.DataFrame({
+        'NPI': np.arange(1_000_000, 1_000_000 + rows),
+        'pri_spec': rng.choice(['CARDIOLOGY', 'DERMATOLOGY', 'FAMILY PRACTICE'], rows),
+        'gndr': rng.choice(['M', 'F'], rows),
+        'st': rng.choice(['CA', 'NY', 'AK'], rows),
+        'Med_sch': rng.choice(['HARVARD', 'YALE', 'OTHER'], rows),
+        'final_MIPS_score': score,
+        'years_experience': rng.integers(0, 40, rows).astype('float64'),
+    })
+
+
+def select(df, filters):
+    for col, value in filters.items():
+        df = df[df[col] == value]
+    return df
+
+
+def load_rows(df):
+    return lambda columns, filters: select(df, filters)[columns]
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'st': 'CA'},
+    {'gndr': 'F'},
+    {'st': 'NY', 'pri_spec': 'CARDIOLOGY'},
+    {'st': 'AK', 'gndr': 'M', 'pri_spec': 'DERMATOLOGY'},
+    # not a cube dimension: rolled up from the matching rows
+    {'Med_sch': 'YALE', 'st': 'CA'},
+])
+def test_summary_matches_pandas(df, filters):
+    cube = ac.build_cube(df, SPEC)
+    summary = ac.summarize(cube.cells(filters, load_rows(df)), cube.measures)
+    rows = select(df, filters)
+    assert summary.providers == rows['NPI'].nunique()
+    for measure in SPEC['measures']:
+        assert summary.means[measure] == pytest.approx(rows[measure].mean())
+    assert summary.by_gender == rows.groupby('gndr')['NPI'].nunique().to_dict()
+    assert summary.specialties == rows['pri_spec'].nunique()
+
+
+def test_cells_use_the_cuboid_of_the_filtered_dims(df):
+    cube = ac.build_cube(df, SPEC)
+    cells = cube.cells({'st': 'CA'})
+    assert set(cells.columns) >= {'pri_spec', 'gndr', 'st'}
+    assert (cells['st'] == 'CA').all()
+    assert len(cube.cells({})) == df.groupby(['pri_spec', 'gndr']).ngroups
+
+
+def test_empty_selection(df):
+    cube = ac.build_cube(df, SPEC)
+    summary = ac.summarize(cube.cells({'st': 'ZZ'}), cube.measures)
+    assert summary.providers == 0
+    assert np.isnan(summary.means['final_MIPS_score'])
+    assert summary.gender_split() == "0.0% : 0.0%"
+
+
+def test_save_and_load_round_trip(df, tmp_path):
+    cube = ac.build_cube(df, SPEC)
+    cube.save(tmp_path / 'cube')
+    loaded = ac.AggregateCube.load(tmp_path / 'cube')
+    assert loaded.layout() == cube.layout()
+    for filters in ({}, {'st': 'NY', 'gndr': 'F'}):
+        expected = ac.summarize(cube.cells(filters), cube.measures)
+        actual = ac.summarize(loaded.cells(filters), loaded.measures)
+        assert (actual.providers, actual.by_gender, actual.specialties) == \
+            (expected.providers, expected.by_gender, expected.specialties)
+        assert actual.means == pytest.approx(expected.means)
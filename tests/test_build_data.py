@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import build_data
+import data_access as dal
+
+BUCKETS = 4
+
+
+def providers_frame(npis, score):
+    return pd.DataFrame({
+        'NPI': [str(npi) for npi in npis],
+        'gndr': ['F' if npi % 2 else 'M' for npi in npis],
+        'st': ['CA' if npi % 3 else 'NY' for npi in npis],
+        'final_MIPS_score': np.full(len(npis), score, dtype='float64'),
+    })
+
+
+@pytest.fixture
+def out_dir(tmp_path):
+    providers = providers_frame(range(1_000, 1_100), 50.0)
+    measures = pd.DataFrame({'NPI': providers['NPI'].repeat(2).to_numpy(), 'measure_cd': ['001', '002'] * len(providers)})
+    build_data.write_tables(providers, measures, str(tmp_path), buckets=BUCKETS)
+    return str(tmp_path)
+
+
+def published(out_dir, name=build_data.PROVIDERS_FILE) -> pd.DataFrame:
+    return dal.read_parquet(name, data_dir=out_dir).sort_values('NPI').reset_index(drop=True)
+
+
+def test_write_tables_round_trip(out_dir):
+    pd.testing.assert_frame_equal(published(out_dir), providers_frame(range(1_000, 1_100), 50.0))
+    assert len(published(out_dir, build_data.MEASURES_FILE)) == 200
+
+
+def test_apply_delta_upserts_and_deletes(out_dir):
+    before = dal.read_manifest(out_dir)['tables'][build_data.PROVIDERS_FILE]
+    # one existing provider updated, one added, one deleted
+    rows = providers_frame([1_010, 5_000], 90.0)
+    build_data.apply_delta(out_dir, build_data.PROVIDERS_FILE, rows, deleted=['1020'])
+
+    expected = providers_frame(range(1_000, 1_100), 50.0)
+    expected = expected[~expected['NPI'].isin(['1010', '1020'])]
+    expected = pd.concat([expected, rows]).sort_values('NPI').reset_index(drop=True)
+    pd.testing.assert_frame_equal(published(out_dir), expected)
+
+    after = dal.read_manifest(out_dir)['tables'][build_data.PROVIDERS_FILE]
+    assert after['version'] != before['version']
+    # only the buckets of the changed NPIs are rewritten
+    changed = set(build_data.npi_buckets(pd.Series(['1010', '5000', '1020']), BUCKETS).astype(str))
+    assert {bucket for bucket in before['parts'] if before['parts'][bucket] != after['parts'].get(bucket)} == changed
+
+
+def test_apply_delta_needs_a_partitioned_table(out_dir):
+    with pytest.raises(ValueError):
+        build_data.apply_delta(out_dir, build_data.OPIOIDS_FILE, providers_frame([1], 1.0))
+
+
+def test_publish_merges_entries_and_keeps_the_previous_parts(out_dir):
+    first = dal.read_manifest(out_dir)
+    build_data.publish(out_dir, derived={'mips_cube': 'abc'})
+    second = dal.read_manifest(out_dir)
+    assert second['release'] == first['release'] + 1
+    assert second['tables'] == first['tables']
+    assert second['derived']['mips_cube'] == 'abc'
+
+    table = os.path.join(out_dir, build_data.PROVIDERS_FILE)
+    build_data.apply_delta(out_dir, build_data.PROVIDERS_FILE, providers_frame([1_001], 10.0))
+    build_data.apply_delta(out_dir, build_data.PROVIDERS_FILE, providers_frame([1_001], 20.0))
+    latest = dal.read_manifest(out_dir)['tables'][build_data.PROVIDERS_FILE]['parts']
+    # the parts of the first delta are still listed by the previous release; the original parts of that bucket are gone
+    assert len(os.listdir(table)) == BUCKETS + 1
+    assert set(latest.values()) <= set(os.listdir(table))
+    assert published(out_dir).set_index('NPI').loc['1001', 'final_MIPS_score'] == 20.0
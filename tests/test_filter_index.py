@@ -0,0 +1,64 @@
+import itertools
+import numpy as np
+import pandas as pd
+import pytest
+from filter_index import FilterIndex
+
+COLUMNS = ['st', 'gndr', 'Med_sch']
+
+
+@pytest.fixture(scope='module')
+def df():
+    rng = np.random.default_rng(0)
+    rows = 5_000
+    return pd.DataFrame({
+        # frequent values (stored as bitmaps) ...
+        'st': rng.choice(['CA', 'NY', 'TX', 'AK'], rows, p=[0.4, 0.3, 0.25, 0.05]),
+        'gndr': pd.Categorical(rng.choice(['M', 'F', None], rows, p=[0.55, 0.44, 0.01])),
+        # ... and rare ones (stored as row ids)
+        'Med_sch': rng.choice([f'school {i}' for i in range(300)] + [None], rows),
+    })
+
+
+def expected(df, filters):
+    '''Plain pandas: one boolean mask per filter'''
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in filters.items():
+        mask &= (df[col] == value).to_numpy(dtype=bool, na_value=False)
+    return np.flatnonzero(mask)
+
+
+def test_stores_both_kinds_of_entries(df):
+    index = FilterIndex(df, COLUMNS)
+    assert index._is_bitmap(index.entries['st']['CA'])
+    assert not index._is_bitmap(index.entries['Med_sch']['school 0'])
+
+
+def test_no_filters_selects_every_row(df):
+    np.testing.assert_array_equal(FilterIndex(df, COLUMNS).select({}), np.arange(len(df)))
+
+
+@pytest.mark.parametrize('filters', [
+    {'st': 'CA'},
+    {'st': 'AK', 'gndr': 'F'},
+    {'Med_sch': 'school 7'},
+    {'st': 'NY', 'Med_sch': 'school 12'},
+    {'st': 'TX', 'gndr': 'M', 'Med_sch': 'school 3'},
+])
+def test_select_matches_boolean_masks(df, filters):
+    np.testing.assert_array_equal(FilterIndex(df, COLUMNS).select(filters), expected(df, filters))
+
+
+def test_every_value_pair(df):
+    index = FilterIndex(df, COLUMNS)
+    for st, gndr in itertools.product(index.values('st'), index.values('gndr')):
+        filters = {'st': st, 'gndr': gndr}
+        np.testing.assert_array_equal(index.select(filters), expected(df, filters))
+
+
+def test_unknown_value_selects_nothing(df):
+    assert len(FilterIndex(df, COLUMNS).select({'st': 'ZZ', 'gndr': 'F'})) == 0
+
+
+def test_values_leave_out_nulls(df):
+    assert sorted(FilterIndex(df, COLUMNS).values('gndr')) == ['F', 'M']
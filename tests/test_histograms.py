@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+import dashboard_utils as dbu
+
+COLUMNS = ['final_MIPS_score', 'Cost_category_score']
+
+
+@pytest.fixture(scope='module')
+def df():
+    rng = np.random.default_rng(2)
+    rows = 2_000
+    score = rng.normal(75, 15, rows).clip(0, 100)
+    cost = rng.uniform(0, 100, rows)
+    cost[rng.random(rows) < 0.3] = np.nan
+    return pd.DataFrame({'final_MIPS_score': score, 'Cost_category_score': cost})
+
+
+def test_counts_and_quartiles_match_numpy(df):
+    histograms = dbu.compute_histograms(df, COLUMNS, nbins=20)
+    for col in COLUMNS:
+        values = df[col].dropna().to_numpy()
+        counts, edges = np.histogram(values, bins=20, range=(values.min(), values.max()))
+        histogram = histograms[col]
+        np.testing.assert_array_equal(histogram['counts'], counts)
+        np.testing.assert_allclose(histogram['edges'], edges)
+        assert histogram['count'] == len(values)
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        assert (histogram['q1'], histogram['median'], histogram['q3']) == pytest.approx((q1, median, q3))
+        # whiskers: the most extreme values within 1.5 IQR of the box
+        inside = values[(values >= q1 - 1.5 * (q3 - q1)) & (values <= q3 + 1.5 * (q3 - q1))]
+        assert (histogram['lowerfence'], histogram['upperfence']) == (inside.min(), inside.max())
+
+
+def test_weighted_counts_match_repeated_rows(df):
+    weights = np.random.default_rng(3).integers(1, 5, len(df))
+    weighted = dbu.compute_histograms(df, COLUMNS, nbins=20, weights=weights)
+    repeated = dbu.compute_histograms(df.loc[df.index.repeat(weights)], COLUMNS, nbins=20)
+    for col in COLUMNS:
+        np.testing.assert_allclose(weighted[col]['counts'], repeated[col]['counts'])
+        assert weighted[col]['count'] == pytest.approx(repeated[col]['count'])
+
+
+def test_weighted_quartiles_with_equal_weights(df):
+    # with equal weights the midpoint rule is numpy's 'hazen' percentile
+    values = df[COLUMNS].to_numpy()
+    valid = ~np.isnan(values)
+    quartiles = dbu.weighted_quartiles(values, valid, np.full(len(df), 2.5))
+    for i, col in enumerate(COLUMNS):
+        expected = np.percentile(df[col].dropna(), [25, 50, 75], method='hazen')
+        np.testing.assert_allclose(quartiles[:, i], expected)
+
+
+def test_weighted_quartiles_follow_the_weights():
+    values = np.array([[1.0], [2.0], [3.0], [100.0]])
+    valid = np.ones_like(values, dtype=bool)
+    # almost all of the weight on 100, then on 1
+    heavy_top = dbu.weighted_quartiles(values, valid, np.array([1.0, 1.0, 1.0, 97.0]))
+    heavy_bottom = dbu.weighted_quartiles(values, valid, np.array([97.0, 1.0, 1.0, 1.0]))
+    assert heavy_top[1, 0] > 90 and heavy_top[2, 0] == 100.0
+    assert heavy_bottom[0, 0] == 1.0 and heavy_bottom[1, 0] < 1.1
+
+
+def test_empty_and_all_null_columns():
+    df = pd.DataFrame({'a': [np.nan, np.nan], 'b': [1.0, 1.0]})
+    histograms = dbu.compute_histograms(df, ['a', 'b'], nbins=5)
+    assert histograms['a']['count'] == 0 and not histograms['a']['counts'].any()
+    assert histograms['b']['count'] == 2 and histograms['b']['counts'].sum() == 2
+    empty = dbu.compute_histograms(df.iloc[:0], ['a', 'b'], nbins=5)
+    assert empty['b']['count'] == 0